@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import pymongo
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class Limiter:
+    """Concurrency limit with a bounded FIFO wait queue for one class of routes."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float,
+                 deadline: float, retry_after: int = 1):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_queue_timeout = 0
+        self.cancelled = 0
+        self.deadline_exceeded = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.shed_queue_full += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed_queue_timeout += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self):
+        # Hand the slot straight to the next waiter so in_flight never dips below the limit
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_queue_timeout": self.shed_queue_timeout,
+            "cancelled": self.cancelled,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
+
+
+class AdmissionMiddleware:
+    """Admits each request through its route class's Limiter or sheds it with 503 Retry-After.
+
+    Admitted requests run in their own task under ``pymongo.timeout`` so every Mongo
+    operation they issue carries the remaining deadline (Motor propagates the context to its
+    worker threads). The task is cancelled when the client disconnects, or when the deadline
+    passes before the response has started; sending the body isn't timed, so a large response
+    to a slow client isn't cut off midway. Clients may ask for a tighter deadline with
+    ``X-Request-Timeout`` (seconds).
+    """
+
+    def __init__(self, app: ASGIApp, limiters: Dict[str, Limiter],
+                 classify: Callable[[str, str], Optional[str]]):
+        self.app = app
+        self.limiters = limiters
+        self.classify = classify
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = self.classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiters[route_class]
+        if not await limiter.acquire():
+            response = JSONResponse(
+                {"detail": f"Server busy ({route_class}), retry later"},
+                status_code=503,
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self._run(scope, receive, send, limiter)
+        finally:
+            limiter.release()
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send, limiter: Limiter):
+        deadline = limiter.deadline
+        requested = Headers(scope=scope).get("x-request-timeout")
+        if requested:
+            try:
+                deadline = max(0.001, min(deadline, float(requested)))
+            except ValueError:
+                pass
+
+        # Watch the connection for a disconnect while the app runs, forwarding everything else
+        inbox: "asyncio.Queue[Message]" = asyncio.Queue(maxsize=4)
+        disconnected = asyncio.Event()
+        started = asyncio.Event()
+
+        async def pump():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                await inbox.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def send_tracked(message: Message):
+            if message["type"] == "http.response.start":
+                started.set()
+            await send(message)
+
+        with pymongo.timeout(deadline):
+            app_task = asyncio.create_task(self.app(scope, inbox.get, send_tracked))
+        pump_task = asyncio.create_task(pump())
+        disconnect_task = asyncio.create_task(disconnected.wait())
+        started_task = asyncio.create_task(started.wait())
+        try:
+            done, _ = await asyncio.wait({app_task, disconnect_task, started_task}, timeout=deadline,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if started_task in done and not done & {app_task, disconnect_task}:
+                # Headers are out; let the body finish unless the client goes away
+                done, _ = await asyncio.wait({app_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+            app_task.cancel()
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("Request failed while being cancelled")
+            if disconnect_task in done:
+                limiter.cancelled += 1
+                return
+            limiter.deadline_exceeded += 1
+            if not started.is_set():
+                response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+                await response(scope, receive, send)
+        finally:
+            for task in (pump_task, disconnect_task, started_task):
+                task.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+
+def parse_limits(spec: str) -> Tuple[int, int, float, float]:
+    """Parse ``concurrency,queue_size,queue_timeout_seconds,deadline_seconds``."""
+    concurrency, queue_size, queue_timeout, deadline = spec.split(",")
+    return int(concurrency), int(queue_size), float(queue_timeout), float(deadline)
+
+
+def snapshot(limiters: Dict[str, Limiter]) -> dict:
+    return {"ts": time.time(), "classes": {name: limiter.snapshot() for name, limiter in limiters.items()}}
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import typer
+from dotenv import load_dotenv
+
+from pymongo import ASCENDING, IndexModel, UpdateOne
+
+import archive
+from reminders import naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Daily rollups maintained by the write handlers. Caseload is stored as per-day deltas so the
+# caseload on any date is the running sum up to it; caseload_current holds that sum for today.
+CASELOAD_DAILY = "rollup_caseload_daily"
+CASELOAD_CURRENT = "rollup_caseload_current"
+STATUS_TRANSITIONS_DAILY = "rollup_status_transitions_daily"
+HEARINGS_WEEKLY = "rollup_hearings_weekly"
+ROLLUPS = (CASELOAD_DAILY, CASELOAD_CURRENT, STATUS_TRANSITIONS_DAILY, HEARINGS_WEEKLY)
+ROLLUP_INDEXES = {
+    CASELOAD_DAILY: [IndexModel([("_id.day", ASCENDING)])],
+    STATUS_TRANSITIONS_DAILY: [IndexModel([("_id.day", ASCENDING)])],
+    HEARINGS_WEEKLY: [IndexModel([("_id.week", ASCENDING)])],
+}
+# The backfill builds each rollup under this suffix and renames it into place
+BACKFILL_SUFFIX = "_backfill"
+
+
+def day_of(value: datetime) -> datetime:
+    # Buckets are UTC days; an offset-aware value would otherwise bucket by its local date
+    value = naive_utc(value)
+    return datetime(value.year, value.month, value.day)
+
+
+def week_of(value: datetime) -> datetime:
+    value = naive_utc(value)
+    return day_of(value) - timedelta(days=value.weekday())
+
+
+def _inc(updates: Counter) -> List[UpdateOne]:
+    return [UpdateOne({"_id": dict(key)}, {"$inc": {"count": count}}, upsert=True)
+            for key, count in updates.items() if count]
+
+
+async def _apply(db, collection: str, updates: Counter):
+    operations = _inc(updates)
+    if operations:
+        await db[collection].bulk_write(operations, ordered=False)
+
+
+async def apply_case_changes(db, changes: Iterable[tuple], when: Optional[datetime] = None, suffix: str = ""):
+    """Apply ``(before, after)`` case pairs; ``None`` on either side means created or deleted."""
+    today = day_of(when or datetime.utcnow())
+    daily, current, transitions = Counter(), Counter(), Counter()
+    for before, after in changes:
+        old = (before["assigned_attorney"], before["status"]) if before else None
+        new = (after["assigned_attorney"], after["status"]) if after else None
+        if old == new:
+            continue
+        if old:
+            daily[(("day", today), ("attorney", old[0]), ("status", old[1]))] -= 1
+            current[(("attorney", old[0]), ("status", old[1]))] -= 1
+        if new:
+            daily[(("day", today), ("attorney", new[0]), ("status", new[1]))] += 1
+            current[(("attorney", new[0]), ("status", new[1]))] += 1
+        # Creations and deletions aren't transitions
+        if old and new and old[1] != new[1]:
+            transitions[(("day", today), ("from", old[1]), ("to", new[1]))] += 1
+    await asyncio.gather(
+        _apply(db, CASELOAD_DAILY + suffix, daily),
+        _apply(db, CASELOAD_CURRENT + suffix, current),
+        _apply(db, STATUS_TRANSITIONS_DAILY + suffix, transitions),
+    )
+
+
+async def apply_hearing_changes(db, court_dates: Iterable[dict], delta: int, suffix: str = ""):
+    hearings = Counter()
+    for court_date in court_dates:
+        hearings[(("week", week_of(court_date["date"])), ("court", court_date["court_name"]))] += delta
+    await _apply(db, HEARINGS_WEEKLY + suffix, hearings)
+
+
+async def caseload(db, as_of: Optional[datetime] = None, statuses: Optional[List[str]] = None) -> List[dict]:
+    match = {}
+    if statuses:
+        match["_id.status"] = {"$in": statuses}
+    if as_of is None:
+        collection = db[CASELOAD_CURRENT]
+    else:
+        collection = db[CASELOAD_DAILY]
+        match["_id.day"] = {"$lte": day_of(as_of)}
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"attorney": "$_id.attorney", "status": "$_id.status"}, "count": {"$sum": "$count"}}},
+        {"$match": {"count": {"$ne": 0}}},
+        {"$group": {
+            "_id": "$_id.attorney",
+            "total": {"$sum": "$count"},
+            "by_status": {"$push": {"k": "$_id.status", "v": "$count"}},
+        }},
+        {"$project": {"_id": 0, "attorney": "$_id", "total": 1, "by_status": {"$arrayToObject": "$by_status"}}},
+        {"$sort": {"total": -1}},
+    ]
+    rows = await collection.aggregate(pipeline).to_list(None)
+    names = {
+        user["id"]: user["name"]
+        async for user in db.users.find({"id": {"$in": [row["attorney"] for row in rows]}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    for row in rows:
+        row["attorney_name"] = names.get(row["attorney"])
+    return rows
+
+
+async def status_transitions(db, start: datetime, end: datetime) -> List[dict]:
+    pipeline = [
+        {"$match": {"_id.day": {"$gte": day_of(start), "$lte": day_of(end)}, "count": {"$ne": 0}}},
+        {"$project": {"_id": 0, "day": "$_id.day", "from": "$_id.from", "to": "$_id.to", "count": 1}},
+        {"$sort": {"day": 1}},
+    ]
+    return await db[STATUS_TRANSITIONS_DAILY].aggregate(pipeline).to_list(None)
+
+
+async def hearings_per_court(db, start: datetime, end: datetime, court: Optional[str] = None) -> List[dict]:
+    match = {"_id.week": {"$gte": week_of(start), "$lte": week_of(end)}, "count": {"$gt": 0}}
+    if court:
+        match["_id.court"] = court
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, "week": "$_id.week", "court": "$_id.court", "count": 1}},
+        {"$sort": {"week": 1, "court": 1}},
+    ]
+    return await db[HEARINGS_WEEKLY].aggregate(pipeline).to_list(None)
+
+
+async def backfill(db) -> dict:
+    """Rebuild every rollup from the source collections.
+
+    History before the rollups existed is approximated: each case counts towards its current
+    attorney and status from the day it was created, and status transitions come from the
+    audit log. The rollups are built under new names and renamed over the live ones at the
+    end, so an interrupted run leaves the previous rollups in place. Writes made while it
+    runs aren't in the result, so run it while writes are quiet.
+    """
+    staged = {collection: collection + BACKFILL_SUFFIX for collection in ROLLUPS}
+    for collection, staging in staged.items():
+        # Leftovers of an interrupted run
+        await db[staging].drop()
+        # Creating the indexes also creates the collection, which the rename needs even if it stays empty
+        await db[staging].create_indexes(ROLLUP_INDEXES.get(collection, [IndexModel([("_id", ASCENDING)])]))
+
+    day = {"$dateTrunc": {"date": "$created_at", "unit": "day"}}
+    await db.cases.aggregate([
+        {"$group": {"_id": {"day": day, "attorney": "$assigned_attorney", "status": "$status"}, "count": {"$sum": 1}}},
+        {"$merge": {"into": staged[CASELOAD_DAILY], "whenMatched": "replace"}},
+    ]).to_list(None)
+    await db.cases.aggregate([
+        {"$group": {"_id": {"attorney": "$assigned_attorney", "status": "$status"}, "count": {"$sum": 1}}},
+        {"$merge": {"into": staged[CASELOAD_CURRENT], "whenMatched": "replace"}},
+    ]).to_list(None)
+    await db.audit_log.aggregate([
+        {"$match": {"entity": "case", "action": "update", "changes.status": {"$exists": True}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateTrunc": {"date": "$ts", "unit": "day"}},
+                "from": "$changes.status.before",
+                "to": "$changes.status.after",
+            },
+            "count": {"$sum": 1},
+        }},
+        {"$merge": {"into": staged[STATUS_TRANSITIONS_DAILY], "whenMatched": "replace"}},
+    ]).to_list(None)
+    await db.court_dates.aggregate([
+        {"$group": {
+            "_id": {
+                "week": {"$dateTrunc": {"date": "$date", "unit": "week", "startOfWeek": "monday"}},
+                "court": "$court_name",
+            },
+            "count": {"$sum": 1},
+        }},
+        {"$merge": {"into": staged[HEARINGS_WEEKLY], "whenMatched": "replace"}},
+    ]).to_list(None)
+
+    # Archived records may be compressed, so they're folded in from Python
+    archived_cases, batch = 0, []
+    async for record in db[archive.ARCHIVES["cases"]].find():
+        batch.append(archive.unpack(record))
+        archived_cases += 1
+        if len(batch) >= 1000:
+            await _backfill_archived_cases(db, batch)
+            batch = []
+    await _backfill_archived_cases(db, batch)
+    batch = []
+    async for record in db[archive.ARCHIVES["court_dates"]].find():
+        batch.append(archive.unpack(record))
+        if len(batch) >= 1000:
+            await apply_hearing_changes(db, batch, 1, BACKFILL_SUFFIX)
+            batch = []
+    await apply_hearing_changes(db, batch, 1, BACKFILL_SUFFIX)
+
+    for collection, staging in staged.items():
+        await db[staging].rename(collection, dropTarget=True)
+    counts = {collection: await db[collection].count_documents({}) for collection in ROLLUPS}
+    logger.info(f"Analytics backfill complete ({archived_cases} archived cases): {counts}")
+    return counts
+
+
+async def _backfill_archived_cases(db, cases: List[dict]):
+    by_day = {}
+    for case in cases:
+        by_day.setdefault(day_of(case["created_at"]), []).append((None, case))
+    for when, changes in by_day.items():
+        await apply_case_changes(db, changes, when, BACKFILL_SUFFIX)
+
+
+cli = typer.Typer(help="Maintain the analytics rollups.")
+
+
+@cli.command("backfill")
+def backfill_command(
+    tenant: Optional[str] = typer.Option(None, help="Tenant to rebuild; all registered tenants by default"),
+):
+    """Rebuild the rollups from the source collections."""
+    import tenancy
+    from server import db, tenants
+
+    async def run():
+        for tenant_id in [tenant] if tenant else await tenants.ids():
+            with tenancy.use_tenant(tenant_id):
+                typer.echo(f"{tenant_id}: {await backfill(db)}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    cli()
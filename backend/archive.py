@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+import bson
+from bson import Binary
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Cases in these states are moved out of the working set once they've been idle long enough
+ARCHIVABLE_STATUSES = ["closed", "settled", "dismissed"]
+# hot collection -> archive collection
+ARCHIVES = {
+    "cases": "cases_archive",
+    "court_dates": "court_dates_archive",
+    "documents": "documents_archive",
+}
+BATCH_SIZE = 200
+
+
+def pack(doc: dict, case_id: str, compress: bool, archived_at: datetime) -> dict:
+    doc = {k: v for k, v in doc.items() if k != "_id"}
+    record = {"id": doc["id"], "case_id": case_id, "archived_at": archived_at}
+    if doc.get("blob_id"):
+        # Kept outside the packed data so blob garbage collection can see archived references
+        record["blob_id"] = doc["blob_id"]
+    if compress:
+        record.update(codec="zlib", data=Binary(zlib.compress(bson.encode(doc), 6)))
+    else:
+        record.update(codec=None, data=doc)
+    return record
+
+
+def unpack(record: dict) -> dict:
+    if record.get("codec") == "zlib":
+        return bson.decode(zlib.decompress(record["data"]))
+    return record["data"]
+
+
+async def _copy(source, target, query: dict, case_id: str, compress: bool, archived_at: datetime,
+                transform=None) -> int:
+    """Upsert every document matching ``query`` from ``source`` into ``target``; returns the count."""
+    copied = 0
+    batch = []
+    async for doc in source.find(query):
+        record = transform(doc) if transform else pack(doc, case_id, compress, archived_at)
+        batch.append(ReplaceOne({"id": record["id"]}, record, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            await target.bulk_write(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+    if batch:
+        await target.bulk_write(batch, ordered=False)
+        copied += len(batch)
+    return copied
+
+
+async def archive_case(db, case: dict, compress: bool = True) -> dict:
+    # Copy children first and delete the case last, so a crash at any point leaves the case
+    # hot and a rerun simply re-copies (upserts are idempotent)
+    case_id = case["id"]
+    archived_at = datetime.utcnow()
+    counts = {}
+    for collection in ("court_dates", "documents"):
+        counts[collection] = await _copy(db[collection], db[ARCHIVES[collection]], {"case_id": case_id},
+                                         case_id, compress, archived_at)
+    await db.cases_archive.replace_one({"id": case_id}, pack(case, case_id, compress, archived_at), upsert=True)
+    for collection in ("court_dates", "documents"):
+        await db[collection].delete_many({"case_id": case_id})
+    await db.cases.delete_one({"id": case_id})
+    return counts
+
+
+async def archive_inactive_cases(db, older_than: timedelta, compress: bool = True,
+                                 limit: Optional[int] = None, on_archived=None) -> dict:
+    cutoff = datetime.utcnow() - older_than
+    query = {"status": {"$in": ARCHIVABLE_STATUSES}, "updated_at": {"$lt": cutoff}}
+    totals = {"cases": 0, "court_dates": 0, "documents": 0}
+    cursor = db.cases.find(query)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for case in cursor:
+        counts = await archive_case(db, case, compress)
+        totals["cases"] += 1
+        for collection, count in counts.items():
+            totals[collection] += count
+        if on_archived:
+            await on_archived(case, counts)
+    logger.info(f"Archived {totals} (inactive before {cutoff})")
+    return totals
+
+
+async def find_archived_case(db, case_id: str) -> Optional[dict]:
+    record = await db.cases_archive.find_one({"id": case_id})
+    return unpack(record) if record else None
+
+
+async def restore_case(db, case_id: str) -> Optional[dict]:
+    record = await db.cases_archive.find_one({"id": case_id})
+    if not record:
+        return None
+    case = unpack(record)
+    # Touch updated_at so the next archival run doesn't move it straight back
+    case["updated_at"] = datetime.utcnow()
+    for collection in ("court_dates", "documents"):
+        await _copy(db[ARCHIVES[collection]], db[collection], {"case_id": case_id}, case_id, False, None,
+                    transform=unpack)
+    await db.cases.replace_one({"id": case_id}, case, upsert=True)
+    for collection in ARCHIVES.values():
+        await db[collection].delete_many({"case_id": case_id})
+    return case
+
+
+if __name__ == "__main__":
+    import typer
+
+    def main(
+        older_than_days: int = typer.Option(365, help="Archive cases untouched for this many days"),
+        compress: bool = typer.Option(True, help="Store archived documents zlib-compressed"),
+        limit: Optional[int] = typer.Option(None, help="Archive at most this many cases per tenant"),
+        tenant: Optional[str] = typer.Option(None, help="Tenant to archive; all registered tenants by default"),
+    ):
+        import tenancy
+        # The same path as POST /api/archive/run, so runs are audited and the view and caches follow
+        from server import archive_inactive_cases as archive_with_hooks, audit_log, cache, tenants
+
+        async def run():
+            await cache.start()
+            try:
+                for tenant_id in [tenant] if tenant else await tenants.ids():
+                    with tenancy.use_tenant(tenant_id):
+                        totals = await archive_with_hooks(timedelta(days=older_than_days), compress, limit)
+                    typer.echo(f"{tenant_id}: {totals}")
+            finally:
+                # Writes the buffered audit records
+                await audit_log.close()
+                await cache.close()
+
+        asyncio.run(run())
+
+    typer.run(main)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from tenancy import current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+# Who is making the current request; set from the X-User-Id header by ActorMiddleware
+current_actor: ContextVar[Optional[str]] = ContextVar("current_actor", default=None)
+
+# Never copied into audit records
+OMITTED_FIELDS = {"_id", "file_data", "content"}
+# Enough of a rejected entry to reconstruct what happened
+MAX_DEAD_LETTER_CHARS = 10000
+
+
+class ActorMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_actor.set(Headers(scope=scope).get("x-user-id"))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_actor.reset(token)
+
+
+def snapshot(doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    return {k: v for k, v in doc.items() if k not in OMITTED_FIELDS}
+
+
+def diff(before: Optional[dict], after: Optional[dict]) -> Dict[str, Dict[str, Any]]:
+    before, after = snapshot(before) or {}, snapshot(after) or {}
+    return {
+        field: {"before": before.get(field), "after": after.get(field)}
+        for field in sorted(before.keys() | after.keys())
+        if before.get(field) != after.get(field)
+    }
+
+
+class AuditLog:
+    """Append-only change log written off the request path.
+
+    ``record`` only appends to an in-memory buffer; a background task flushes it with
+    ``insert_many`` every ``flush_interval`` seconds or as soon as ``batch_size`` entries
+    are waiting. ``close`` drains the buffer, so call it on shutdown before closing Mongo.
+    Entries remember the tenant they were recorded for and are written to its database.
+    Entries Mongo rejects outright are moved to ``dead_letter`` so they can't block the rest.
+    """
+
+    def __init__(self, collection, dead_letter=None, batch_size: int = 500, flush_interval: float = 1.0):
+        self.collection = collection
+        self.dead_letter = dead_letter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[Tuple[str, dict]] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for attempt in range(5):
+            await self.flush()
+            if not self._buffer:
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logger.error(f"Audit log closed with {len(self._buffer)} unflushed entries")
+
+    def record(self, entity: str, entity_id: str, action: str,
+               before: Optional[dict] = None, after: Optional[dict] = None, **extra):
+        entry = {
+            "id": str(uuid.uuid4()),
+            "entity": entity,
+            "entity_id": entity_id,
+            "action": action,
+            "actor": current_actor.get(),
+            "ts": datetime.utcnow(),
+            "changes": diff(before, after),
+        }
+        entry.update(extra)
+        self._buffer.append((current_tenant.get(), entry))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def pending(self, entity_id: str) -> List[dict]:
+        """Unflushed entries for ``entity_id`` or, for hearings and documents, the case it owns them."""
+        tenant = current_tenant.get()
+        return [dict(entry) for entry_tenant, entry in self._buffer
+                if entry_tenant == tenant and entity_id in (entry["entity_id"], entry.get("case_id"))]
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                for tenant, group in groupby(batch, key=lambda item: item[0]):
+                    entries = [entry for _, entry in group]
+                    try:
+                        with use_tenant(tenant):
+                            await self.collection.insert_many(entries, ordered=False)
+                    except BulkWriteError as e:
+                        # Duplicates mean a previous, partially failed flush already wrote them
+                        rejected = [error for error in e.details["writeErrors"] if error["code"] != 11000]
+                        if rejected:
+                            with use_tenant(tenant):
+                                await self._dead_letter(entries, rejected)
+                    except Exception as e:
+                        # Retry on the next tick
+                        logger.warning(f"Audit flush of {len(entries)} entries failed: {e}")
+                        return
+                del self._buffer[:len(batch)]
+
+    async def _dead_letter(self, entries: List[dict], errors: List[dict]):
+        """Set aside entries Mongo refused; retrying them would fail the same way forever."""
+        records = [
+            {
+                "id": entries[error["index"]]["id"],
+                "entity": entries[error["index"]]["entity"],
+                "entity_id": entries[error["index"]]["entity_id"],
+                "action": entries[error["index"]]["action"],
+                "ts": entries[error["index"]]["ts"],
+                "error": error.get("errmsg"),
+                "entry": repr(entries[error["index"]])[:MAX_DEAD_LETTER_CHARS],
+            }
+            for error in errors
+        ]
+        logger.error(f"Audit flush rejected {len(records)} entries: {[record['error'] for record in records]}")
+        if self.dead_letter is None:
+            return
+        try:
+            await self.dead_letter.insert_many(records, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to dead-letter audit entries {[record['id'] for record in records]}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
@@ -0,0 +1,514 @@
+"""Application-level backup and restore.
+
+A backup is a directory holding ``manifest.json`` and, per collection, zstd-compressed streams
+of BSON documents split into parts of ``part_size`` documents. The manifest records every
+finished part as a checkpoint, so an interrupted backup resumes where it stopped and a restore
+loads parts in parallel. File bodies stay out of the streams: blob files are copied to
+``blobs/`` and inline document content to ``objects/``, both content-addressed and shared by
+all backups in the destination, so each body is copied once however many backups include it.
+
+Collections are read one by one, so a backup taken under load may include writes made while
+it ran. With ``snapshot`` on a replica set, every collection is instead read at one cluster
+time (``readConcern: snapshot``), recorded in the manifest, so a case deleted mid-backup is
+either present with its hearings and documents or absent with them. That is opt-in because
+the server only keeps snapshot history for ``minSnapshotHistoryWindowInSeconds`` (300 by
+default): a backup that runs longer fails, so raise the window first for large databases.
+
+Incremental backups take the documents inserted (by ``_id`` time) or updated since the
+previous backup started, plus the IDs still present in each collection so a restore can drop
+what was deleted in between. Every increment overlaps the previous one and restores upsert,
+so a chain converges. The reminder outbox is included so a restored database doesn't send
+reminders again, and the default tenant's backup carries the tenant registry, so restoring it
+keeps the other tenants reachable (their databases are backed up on their own). Analytics
+rollups and the court date view are derived and not backed up; rebuild them after restoring.
+Upload sessions are left out with the partial files they point to: uploads in flight when the
+backup ran are lost on restore, and clients start them again.
+"""
+import base64
+import hashlib
+import io
+import itertools
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import bson
+import typer
+import zstandard
+from bson import ObjectId, json_util
+from dotenv import load_dotenv
+from pymongo import ASCENDING, InsertOne, MongoClient, ReplaceOne
+from pymongo.errors import OperationFailure
+
+import tenancy
+from blobs import READ_SIZE, BlobStore, tenant_root
+from storage import human
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+COLLECTIONS = [
+    "users", "clients", "cases", "court_dates", "documents",
+    "cases_archive", "court_dates_archive", "documents_archive", "audit_log", "reminder_outbox",
+    "tenants",
+]
+# Inserts are found by _id time; these fields move when an existing document changes
+UPDATED_FIELDS = {
+    "cases": ("updated_at",),
+    "cases_archive": ("archived_at",),
+    "court_dates_archive": ("archived_at",),
+    "documents_archive": ("archived_at",),
+    # Outbox _ids are strings, so inserts are found by created_at; deliveries set claimed_at
+    "reminder_outbox": ("created_at", "claimed_at"),
+}
+# Field increments match documents on; the rest use the application ID
+KEY_FIELDS = {"reminder_outbox": "_id"}
+# Server error for a snapshot read older than the server's snapshot history
+SNAPSHOT_TOO_OLD = 239
+# Collections whose documents reference file bodies
+BODY_COLLECTIONS = {"documents", "documents_archive"}
+# Inline body fields, moved to objects/ and replaced by a reference
+BODY_FIELDS = ("content", "file_data")
+# Covers writes that took their timestamp before the previous backup started but landed after
+OVERLAP = timedelta(minutes=5)
+BATCH_SIZE = 1000
+MANIFEST = "manifest.json"
+
+
+def _dumps(value) -> str:
+    return json_util.dumps(value, json_options=json_util.RELAXED_JSON_OPTIONS, indent=2)
+
+
+def load_manifest(dest: Path, backup_id: str) -> dict:
+    path = dest / backup_id / MANIFEST
+    if not path.exists():
+        raise ValueError(f"No backup {backup_id!r} in {dest}")
+    return json_util.loads(path.read_text())
+
+
+def list_backups(dest: Path) -> List[dict]:
+    return [json_util.loads(path.read_text()) for path in sorted(dest.glob(f"*/{MANIFEST}"))]
+
+
+def backup_chain(dest: Path, backup_id: str) -> List[dict]:
+    """The full backup ``backup_id`` builds on, followed by each increment up to it."""
+    chain = [load_manifest(dest, backup_id)]
+    while chain[-1]["base"]:
+        chain.append(load_manifest(dest, chain[-1]["base"]))
+    return chain[::-1]
+
+
+def _write_stream(path: Path, docs, level: int) -> int:
+    """Write BSON documents to a zstd stream at ``path``; returns how many were written."""
+    count = 0
+    with open(path, "wb") as f:
+        with zstandard.ZstdCompressor(level=level).stream_writer(f, closefd=False) as writer:
+            for doc in docs:
+                writer.write(bson.encode(doc))
+                count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    return count
+
+
+def _read_stream(path: Path) -> Iterator[dict]:
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_size=READ_SIZE)
+        yield from bson.decode_file_iter(io.BufferedReader(reader, READ_SIZE))
+
+
+def _snapshot_time(database):
+    """The cluster time to read every collection at, or None on a standalone server."""
+    hello = database.client.admin.command("hello")
+    if "setName" not in hello and hello.get("msg") != "isdbgrid":
+        logger.warning(f"{database.name} is not on a replica set; backing up without a snapshot")
+        return None
+    with database.client.start_session(snapshot=True) as session:
+        database[COLLECTIONS[0]].find_one({}, session=session)
+        return _session_snapshot_time(session)
+
+
+# pymongo (pinned in requirements.txt) keeps a snapshot session's atClusterTime private and has no
+# public way to start one at a given time, and ReadConcern doesn't take atClusterTime; collections
+# are read in parallel, one session per thread, so each session is pinned to the backup's time
+def _session_snapshot_time(session):
+    if not hasattr(session, "_snapshot_time"):
+        raise RuntimeError("This pymongo version doesn't expose snapshot times; back up without --snapshot")
+    return session._snapshot_time
+
+
+@contextmanager
+def _snapshot_session(client, cluster_time):
+    if cluster_time is None:
+        yield None
+        return
+    with client.start_session(snapshot=True) as session:
+        _session_snapshot_time(session)  # fails loudly if pymongo stops keeping it there
+        session._snapshot_time = cluster_time
+        yield session
+
+
+def _copy_blob(source: BlobStore, target: BlobStore, blob_id: str) -> int:
+    """Copy a blob as stored (compressed or not) unless ``target`` has it; returns bytes copied."""
+    if target.locate(blob_id)[0] is not None:
+        return 0
+    path, codec = source.locate(blob_id)
+    if path is None:
+        logger.warning(f"Blob {blob_id} is referenced but missing from {source.root}")
+        return 0
+    destination = target.path(blob_id, codec)
+    destination.parent.mkdir(exist_ok=True)
+    partial = destination.with_name(f"{destination.name}.{uuid.uuid4().hex}.partial")
+    shutil.copyfile(path, partial)
+    os.replace(partial, destination)
+    return destination.stat().st_size
+
+
+class _Bodies:
+    """Moves file bodies between live storage and a destination's content-addressed sets."""
+
+    def __init__(self, dest: Path, store: BlobStore, pool: ThreadPoolExecutor):
+        self.objects = dest / "objects"
+        self.blobs = BlobStore(dest / "blobs")
+        self.store = store
+        self.pool = pool
+        self.copied = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    def _submit_blob(self, source: BlobStore, target: BlobStore, blob_id: str) -> list:
+        with self._lock:
+            if blob_id in self._seen:
+                return []
+            self._seen.add(blob_id)
+        return [self.pool.submit(self._count, _copy_blob, source, target, blob_id)]
+
+    def _count(self, copy, *args):
+        copied = copy(*args)
+        with self._lock:
+            self.copied += copied
+
+    def save(self, doc: dict) -> list:
+        """Take the bodies out of ``doc``; returns futures for blob copies still running."""
+        refs = {}
+        for field in BODY_FIELDS:
+            value = doc.pop(field, None)
+            if value is None:
+                continue
+            data = base64.b64decode(value) if field == "file_data" else bytes(value)
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._object_path(digest)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                partial = path.with_name(f"{digest}.{uuid.uuid4().hex}.partial")
+                partial.write_bytes(data)
+                os.replace(partial, path)
+                with self._lock:
+                    self.copied += len(data)
+            refs[field] = digest
+        if refs:
+            doc["_backup_refs"] = refs
+        if doc.get("blob_id"):
+            return self._submit_blob(self.store, self.blobs, doc["blob_id"])
+        return []
+
+    def load(self, doc: dict) -> list:
+        """Put the bodies back into ``doc``; returns futures for blob copies still running."""
+        for field, digest in doc.pop("_backup_refs", {}).items():
+            data = self._object_path(digest).read_bytes()
+            doc[field] = base64.b64encode(data).decode() if field == "file_data" else data
+        if doc.get("blob_id"):
+            return self._submit_blob(self.blobs, self.store, doc["blob_id"])
+        return []
+
+
+def _backup_collection(database, directory: Path, name: str, manifest: dict, bodies: _Bodies,
+                       since: Optional[datetime], part_size: int, level: int, save):
+    entry = manifest["collections"][name]
+    if entry["done"]:
+        return
+    with _snapshot_session(database.client, manifest.get("cluster_time")) as session:
+        _backup_documents(database, directory, name, entry, bodies, since, part_size, level, save, session)
+        if manifest["kind"] == "incremental":
+            key = KEY_FIELDS.get(name, "id")
+            ids = database[name].find({}, {"_id": 0, key: 1} if key != "_id" else {"_id": 1},
+                                      batch_size=BATCH_SIZE, session=session)
+            _write_stream(directory / f"{name}.ids.bson.zst", ids, level)
+            save(lambda: entry.update(ids=f"{name}.ids.bson.zst"))
+    save(lambda: entry.update(done=True))
+
+
+def _backup_documents(database, directory: Path, name: str, entry: dict, bodies: _Bodies,
+                      since: Optional[datetime], part_size: int, level: int, save, session):
+    query = {}
+    if since is not None:
+        changed = [{"_id": {"$gte": ObjectId.from_datetime(since)}}]
+        changed += [{field: {"$gte": since}} for field in UPDATED_FIELDS.get(name, ())]
+        query = {"$or": changed}
+    if entry["last_id"] is not None:
+        query = {"$and": [query, {"_id": {"$gt": entry["last_id"]}}]}
+    cursor = database[name].find(query, sort=[("_id", ASCENDING)], batch_size=BATCH_SIZE, session=session)
+
+    while True:
+        filename = f"{name}.{len(entry['parts']):05d}.bson.zst"
+        pending = []
+        last = {}
+
+        def docs():
+            for doc in itertools.islice(cursor, part_size):
+                last["_id"] = doc["_id"]
+                if name in BODY_COLLECTIONS:
+                    pending.extend(bodies.save(doc))
+                yield doc
+
+        count = _write_stream(directory / filename, docs(), level)
+        for future in pending:
+            future.result()
+        if count == 0:
+            (directory / filename).unlink()
+            break
+        part = {"file": filename, "count": count, "bytes": (directory / filename).stat().st_size}
+
+        def checkpoint():
+            entry["parts"].append(part)
+            entry.update(count=entry["count"] + count, last_id=last["_id"])
+
+        save(checkpoint)
+        if count < part_size:
+            break
+
+
+def backup(database, store: BlobStore, dest: Path, incremental: bool = False, resume: Optional[str] = None,
+           part_size: int = 100_000, workers: int = 4, level: int = 3, snapshot: bool = False) -> dict:
+    """Take a backup into ``dest`` (or finish the one named ``resume``) and return its manifest.
+
+    A resumed snapshot backup reads at its original cluster time, so it only resumes within the
+    server's snapshot history.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    if resume:
+        manifest = load_manifest(dest, resume)
+    else:
+        base = None
+        if incremental:
+            completed = [m for m in list_backups(dest) if m["completed_at"] and m["database"] == database.name]
+            if not completed:
+                raise ValueError(f"No completed backup of {database.name} in {dest} to build on")
+            base = completed[-1]
+        started_at = datetime.utcnow()
+        manifest = {
+            "format": FORMAT,
+            "id": started_at.strftime("%Y%m%dT%H%M%SZ"),
+            "database": database.name,
+            "kind": "incremental" if base else "full",
+            "base": base["id"] if base else None,
+            "since": base["started_at"] - OVERLAP if base else None,
+            "started_at": started_at,
+            "cluster_time": _snapshot_time(database) if snapshot else None,
+            "completed_at": None,
+            "collections": {name: {"parts": [], "count": 0, "last_id": None, "done": False} for name in COLLECTIONS},
+        }
+    directory = dest / manifest["id"]
+    directory.mkdir(exist_ok=True)
+    lock = threading.Lock()
+
+    def save(change=None):
+        with lock:
+            if change:
+                change()
+            path = directory / MANIFEST
+            partial = path.with_suffix(".partial")
+            partial.write_text(_dumps(manifest))
+            os.replace(partial, path)
+
+    save()
+    # Parts written after the last checkpoint are incomplete; they're rewritten on resume
+    recorded = {part["file"] for entry in manifest["collections"].values() for part in entry["parts"]}
+    for path in directory.glob("*.bson.zst"):
+        if path.name not in recorded:
+            path.unlink()
+
+    with ThreadPoolExecutor(workers) as blob_pool, ThreadPoolExecutor(workers) as pool:
+        bodies = _Bodies(dest, store, blob_pool)
+        futures = [
+            pool.submit(_backup_collection, database, directory, name, manifest, bodies,
+                        manifest["since"], part_size, level, save)
+            for name in manifest["collections"]
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except OperationFailure as e:
+            if e.code == SNAPSHOT_TOO_OLD:
+                raise ValueError(f"Backup {manifest['id']} outlived the server's snapshot history; raise "
+                                 f"minSnapshotHistoryWindowInSeconds or back up without --snapshot") from e
+            raise
+    save(lambda: manifest.update(completed_at=datetime.utcnow(), bodies_copied=bodies.copied))
+    return manifest
+
+
+def _restore_part(database, directory: Path, name: str, part: dict, insert: bool, bodies: _Bodies) -> int:
+    collection = database[name]
+    key = KEY_FIELDS.get(name, "id")
+    pending = []
+    batch = []
+    restored = 0
+    for doc in _read_stream(directory / part["file"]):
+        pending.extend(bodies.load(doc))
+        if insert:
+            batch.append(InsertOne(doc))
+        else:
+            # Matched on the application ID; _id may differ if the document was re-inserted
+            if key != "_id":
+                doc.pop("_id", None)
+            batch.append(ReplaceOne({key: doc[key]}, doc, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            restored += len(batch)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+        restored += len(batch)
+    for future in pending:
+        future.result()
+    return restored
+
+
+def _apply_deletes(database, directory: Path, manifest: dict) -> Dict[str, int]:
+    deleted = {}
+    for name, entry in manifest["collections"].items():
+        if not entry.get("ids"):
+            continue
+        key = KEY_FIELDS.get(name, "id")
+        keep = {doc.get(key) for doc in _read_stream(directory / entry["ids"])}
+        gone = [doc[key] for doc in database[name].find({}, {key: 1}) if doc.get(key) not in keep]
+        for start in range(0, len(gone), BATCH_SIZE):
+            database[name].delete_many({key: {"$in": gone[start:start + BATCH_SIZE]}})
+        deleted[name] = len(gone)
+    return deleted
+
+
+def restore(database, store: BlobStore, dest: Path, backup_id: str, workers: int = 8, drop: bool = False) -> dict:
+    """Restore ``backup_id`` (with the backups it builds on) into an empty ``database``."""
+    chain = backup_chain(dest, backup_id)
+    for manifest in chain:
+        if not manifest["completed_at"]:
+            raise ValueError(f"Backup {manifest['id']} did not complete; resume it or pick another")
+    for name in COLLECTIONS:
+        if drop:
+            database.drop_collection(name)
+        elif database[name].estimated_document_count():
+            raise ValueError(f"{database.name}.{name} is not empty; pass --drop to replace it")
+
+    counts = {name: 0 for name in COLLECTIONS}
+    with ThreadPoolExecutor(workers) as blob_pool, ThreadPoolExecutor(workers) as pool:
+        bodies = _Bodies(dest, store, blob_pool)
+        for position, manifest in enumerate(chain):
+            directory = dest / manifest["id"]
+            if position == 1:
+                # Increments upsert by id; the full backup loads faster without the index
+                for name in COLLECTIONS:
+                    if KEY_FIELDS.get(name, "id") != "_id":
+                        database[name].create_index([("id", ASCENDING)], unique=True)
+            parts = [(name, part) for name, entry in manifest["collections"].items() for part in entry["parts"]]
+            futures = [(name, pool.submit(_restore_part, database, directory, name, part, position == 0, bodies))
+                       for name, part in parts]
+            for name, future in futures:
+                counts[name] += future.result()
+        deleted = _apply_deletes(database, dest / chain[-1]["id"], chain[-1]) if len(chain) > 1 else {}
+    return {"restored": counts, "deleted": deleted, "bodies_copied": bodies.copied, "backups": [m["id"] for m in chain]}
+
+
+cli = typer.Typer(help="Back up and restore application data.")
+
+
+def _open(mongo_url: str, db_name: str, blob_dir: str, tenant: str):
+    database = MongoClient(mongo_url)[tenancy.database_name(db_name, tenant)]
+    return database, BlobStore(tenant_root(Path(blob_dir), tenant))
+
+
+@cli.command("backup")
+def backup_command(
+    dest: Path = typer.Argument(..., help="Directory holding the backups"),
+    incremental: bool = typer.Option(False, help="Only take what changed since the latest backup in DEST"),
+    resume: Optional[str] = typer.Option(None, help="Finish an interrupted backup with this ID"),
+    tenant: str = typer.Option(tenancy.DEFAULT_TENANT, help="Tenant to back up"),
+    part_size: int = typer.Option(100_000, help="Documents per compressed part"),
+    workers: int = typer.Option(4, help="Collections and blob copies processed in parallel"),
+    level: int = typer.Option(3, help="zstd level of the document streams"),
+    snapshot: bool = typer.Option(False, help="Read every collection at one cluster time (replica sets only; "
+                                              "must finish within the server's snapshot history window)"),
+    mongo_url: str = typer.Option(..., envvar="MONGO_URL"),
+    db_name: str = typer.Option(..., envvar="DB_NAME"),
+    blob_dir: str = typer.Option(str(Path(__file__).parent / 'blobs'), envvar="BLOB_DIR"),
+):
+    """Stream every collection and the file bodies they reference into DEST."""
+    database, store = _open(mongo_url, db_name, blob_dir, tenant)
+    started = time.monotonic()
+    try:
+        manifest = backup(database, store, dest, incremental, resume, part_size, workers, level, snapshot)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    for name, entry in manifest["collections"].items():
+        size = sum(part["bytes"] for part in entry["parts"])
+        typer.echo(f"{name:<22}{entry['count']:>12,} docs {human(size):>10}")
+    typer.echo(f"{manifest['kind']} backup {manifest['id']} done in {time.monotonic() - started:.1f}s, "
+               f"{human(manifest['bodies_copied'])} of file bodies copied")
+
+
+@cli.command("restore")
+def restore_command(
+    dest: Path = typer.Argument(..., help="Directory holding the backups"),
+    backup_id: Optional[str] = typer.Argument(None, help="Backup to restore; defaults to the latest"),
+    tenant: str = typer.Option(tenancy.DEFAULT_TENANT, help="Tenant to restore into"),
+    drop: bool = typer.Option(False, help="Drop existing collections first"),
+    workers: int = typer.Option(8, help="Parts and blob copies restored in parallel"),
+    mongo_url: str = typer.Option(..., envvar="MONGO_URL"),
+    db_name: str = typer.Option(..., envvar="DB_NAME"),
+    blob_dir: str = typer.Option(str(Path(__file__).parent / 'blobs'), envvar="BLOB_DIR"),
+):
+    """Restore a backup with parallel bulk writes; start the server afterwards to build indexes."""
+    database, store = _open(mongo_url, db_name, blob_dir, tenant)
+    if backup_id is None:
+        completed = [m for m in list_backups(dest) if m["completed_at"]]
+        if not completed:
+            raise typer.BadParameter(f"No completed backup in {dest}")
+        backup_id = completed[-1]["id"]
+    started = time.monotonic()
+    try:
+        result = restore(database, store, dest, backup_id, workers, drop)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    for name, count in result["restored"].items():
+        deleted = result["deleted"].get(name)
+        typer.echo(f"{name:<22}{count:>12,} docs" + (f", {deleted:,} deleted" if deleted else ""))
+    typer.echo(f"Restored {' + '.join(result['backups'])} in {time.monotonic() - started:.1f}s, "
+               f"{human(result['bodies_copied'])} of file bodies copied")
+    typer.echo("Rebuild the rollups with 'python analytics.py backfill' and the court date view with "
+               "'python court_date_view.py rebuild'.")
+
+
+@cli.command("list")
+def list_command(dest: Path = typer.Argument(..., help="Directory holding the backups")):
+    """Show the backups in DEST."""
+    for manifest in list_backups(dest):
+        total = sum(entry["count"] for entry in manifest["collections"].values())
+        status = "complete" if manifest["completed_at"] else "incomplete"
+        base = f" on {manifest['base']}" if manifest["base"] else ""
+        typer.echo(f"{manifest['id']}  {manifest['database']}  {manifest['kind']}{base}  {total:,} docs  {status}")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    cli()
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from tenancy import DEFAULT_TENANT, current_tenant
+
+logger = logging.getLogger(__name__)
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+READ_SIZE = 1024 * 1024
+# File name suffix per storage codec
+SUFFIXES = {None: "", "zstd": ".zst"}
+
+
+def tenant_root(root: Path, tenant: str) -> Path:
+    return root if tenant == DEFAULT_TENANT else root / "tenants" / tenant
+
+
+def sha256_file(path: Path, hasher=None, start: int = 0):
+    """Feed ``path`` from ``start`` into ``hasher`` (a fresh sha256 by default) in fixed-size reads."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(start)
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                return hasher
+            hasher.update(data)
+
+
+class BlobStore:
+    """Content-addressed file storage for large document bodies.
+
+    Blobs are named by the sha256 of their original bytes, so identical files are stored once,
+    with a suffix for the codec they're stored with. Uploads in progress are written to
+    ``partial/`` and moved into place atomically when finalized. Tenants other than the
+    default one get their own tree under ``tenants/``, so content is never shared across firms.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._prepared = set()
+        self._tenant_root(DEFAULT_TENANT)
+
+    def _tenant_root(self, tenant: str) -> Path:
+        root = tenant_root(self.root, tenant)
+        if tenant not in self._prepared:
+            (root / "partial").mkdir(parents=True, exist_ok=True)
+            (root / "sha256").mkdir(parents=True, exist_ok=True)
+            self._prepared.add(tenant)
+        return root
+
+    @property
+    def partial_dir(self) -> Path:
+        return self._tenant_root(current_tenant.get()) / "partial"
+
+    @property
+    def blob_dir(self) -> Path:
+        return self._tenant_root(current_tenant.get()) / "sha256"
+
+    def partial_path(self, upload_id: str, codec: Optional[str] = None) -> Path:
+        return self.partial_dir / (upload_id + SUFFIXES[codec])
+
+    def path(self, blob_id: str, codec: Optional[str] = None) -> Path:
+        if not SHA256_RE.match(blob_id):
+            raise ValueError(f"Invalid blob id {blob_id!r}")
+        return self.blob_dir / blob_id[:2] / (blob_id + SUFFIXES[codec])
+
+    def locate(self, blob_id: str) -> Tuple[Optional[Path], Optional[str]]:
+        """Find a blob whichever way it's stored; returns ``(path, codec)`` or ``(None, None)``."""
+        for codec in SUFFIXES:
+            path = self.path(blob_id, codec)
+            if path.exists():
+                return path, codec
+        return None, None
+
+    def commit(self, upload_id: str, blob_id: str, codec: Optional[str] = None) -> Optional[str]:
+        """Move a finished upload into place and return the codec the blob is stored with.
+
+        A blob with the same content is reused, however it was stored.
+        """
+        existing, existing_codec = self.locate(blob_id)
+        if existing is not None:
+            self.discard(upload_id)
+            return existing_codec
+        target = self.path(blob_id, codec)
+        target.parent.mkdir(exist_ok=True)
+        os.replace(self.partial_path(upload_id, codec), target)
+        self.discard(upload_id)
+        return codec
+
+    def discard(self, upload_id: str):
+        for codec in SUFFIXES:
+            self.partial_path(upload_id, codec).unlink(missing_ok=True)
+
+    def delete(self, blob_id: str):
+        for codec in SUFFIXES:
+            self.path(blob_id, codec).unlink(missing_ok=True)
+
+
+class BlobLocks:
+    """Per-blob locks in Mongo, so a blob isn't deleted while an upload is reusing it.
+
+    Deleting a blob is a reference check followed by an unlink, and an upload with the same
+    content can add a reference in between. Both take the blob's lock around their step: the
+    deleter gives up if it's held, an upload waits for it. A lock left by a dead holder is
+    taken over after ``timeout``.
+    """
+
+    def __init__(self, collection, timeout: timedelta = timedelta(minutes=10)):
+        self.collection = collection
+        self.timeout = timeout
+
+    async def acquire(self, blob_id: str) -> Optional[str]:
+        """Take the lock; returns the owner token, or None if someone else holds it."""
+        owner = str(uuid.uuid4())
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({"_id": blob_id, "owner": owner, "locked_at": now})
+            return owner
+        except DuplicateKeyError:
+            pass
+        taken = await self.collection.find_one_and_update(
+            {"_id": blob_id, "locked_at": {"$lt": now - self.timeout}},
+            {"$set": {"owner": owner, "locked_at": now}},
+        )
+        return owner if taken else None
+
+    async def wait(self, blob_id: str, timeout: float) -> Optional[str]:
+        """Take the lock, waiting up to ``timeout`` seconds for the holder; None if it's still held."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.05
+        while True:
+            owner = await self.acquire(blob_id)
+            if owner is not None or loop.time() >= deadline:
+                return owner
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def release(self, blob_id: str, owner: str):
+        try:
+            await self.collection.delete_one({"_id": blob_id, "owner": owner})
+        except Exception as e:
+            # The lock times out on its own
+            logger.warning(f"Could not release blob lock {blob_id}: {e}")
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from fastapi.encoders import jsonable_encoder
+
+from tenancy import DEFAULT_TENANT, current_tenant
+
+logger = logging.getLogger(__name__)
+
+# Versions only have to outlive a load; a missing version just makes the next racing store skip
+VERSION_TTL = 24 * 3600
+
+
+class Cache:
+    """Two-level read-through cache: a small per-process L1 in front of an optional shared Redis.
+
+    Writes go through ``invalidate``, which clears the key everywhere and publishes it so other
+    workers drop their L1 copies. Concurrent misses for the same key share one load. Keys are
+    scoped to the current tenant.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        namespace: str = "app",
+        l1_ttl: float = 5.0,
+        l1_max_entries: int = 1024,
+        lock_timeout: float = 10.0,
+    ):
+        self.redis_url = redis_url
+        self.namespace = namespace
+        self.channel = f"{namespace}:cache:invalidate"
+        self.l1_ttl = l1_ttl
+        self.l1_max_entries = l1_max_entries
+        self.lock_timeout = lock_timeout
+        self.redis: Optional[redis.Redis] = None
+        self._l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._generations: Dict[str, int] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.redis_url:
+            return
+        self.redis = redis.from_url(self.redis_url)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self.redis:
+            await self.redis.aclose()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:cache:{key}"
+
+    @staticmethod
+    def _scoped(key: str) -> str:
+        tenant = current_tenant.get()
+        return key if tenant == DEFAULT_TENANT else f"tenant:{tenant}:{key}"
+
+    def _l1_get(self, key: str):
+        entry = self._l1.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._l1[key]
+            return None
+        self._l1.move_to_end(key)
+        return entry
+
+    def _l1_set(self, key: str, value: Any, ttl: float):
+        self._l1[key] = (time.monotonic() + min(ttl, self.l1_ttl), value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_max_entries:
+            self._l1.popitem(last=False)
+
+    def _l1_drop(self, keys):
+        for key in keys:
+            self._l1.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float = 30.0) -> Any:
+        return await self._get_or_load(self._scoped(key), loader, ttl)
+
+    async def _get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        entry = self._l1_get(key)
+        if entry is not None:
+            return entry[1]
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            generation = self._generations.get(key, 0)
+            try:
+                value = await self._load(key, loader, ttl, generation)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Nobody else may be waiting; don't leave "exception never retrieved" noise
+                future.exception()
+                raise
+            else:
+                future.set_result(value)
+                # An invalidation that raced with the load means the value may already be stale
+                if self._generations.get(key, 0) == generation:
+                    self._l1_set(key, value, ttl)
+                return value
+            finally:
+                del self._inflight[key]
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The loading request was cancelled, not us; take over the load
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                return await self._get_or_load(key, loader, ttl)
+            raise
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float, generation: int) -> Any:
+        if self.redis is None:
+            return jsonable_encoder(await loader())
+        redis_key = self._key(key)
+        version_key = f"{redis_key}:version"
+        try:
+            cached, version = await self.redis.mget(redis_key, version_key)
+            if cached is not None:
+                return json.loads(cached)
+            # Only one worker fills a cold key; the rest wait for it to appear
+            token = uuid.uuid4().hex
+            lock_key = f"{redis_key}:lock"
+            if not await self.redis.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)):
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                    cached, lock, version = await self.redis.mget(redis_key, lock_key, version_key)
+                    if cached is not None:
+                        return json.loads(cached)
+                    if lock is None:
+                        # The holder skipped a store that raced with an invalidation
+                        break
+                token = None
+        except redis.RedisError as e:
+            logger.warning(f"Redis unavailable, loading {key} directly: {e}")
+            return jsonable_encoder(await loader())
+
+        try:
+            value = jsonable_encoder(await loader())
+            try:
+                await self._store(redis_key, version_key, version, value, ttl, generation, key)
+            except redis.RedisError as e:
+                logger.warning(f"Failed to store {key} in Redis: {e}")
+            return value
+        finally:
+            if token is not None:
+                try:
+                    if await self.redis.get(lock_key) == token.encode():
+                        await self.redis.delete(lock_key)
+                except redis.RedisError:
+                    pass
+
+    async def _store(self, redis_key: str, version_key: str, version: Optional[bytes], value: Any, ttl: float,
+                     generation: int, key: str):
+        """Store a loaded value unless the key was invalidated while the loader was reading.
+
+        ``invalidate`` bumps the key's version in Redis, so a loader that read Mongo before a write
+        on any worker can't put its stale result back after the write deleted the key.
+        """
+        if self._generations.get(key, 0) != generation:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(version_key)
+            if await pipe.get(version_key) != version:
+                return
+            pipe.multi()
+            pipe.set(redis_key, json.dumps(value), ex=max(1, int(ttl)))
+            try:
+                await pipe.execute()
+            except redis.WatchError:
+                pass
+
+    async def invalidate(self, *keys: str):
+        keys = [self._scoped(key) for key in keys]
+        self._l1_drop(keys)
+        if self.redis is None or not keys:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(*(self._key(key) for key in keys))
+                for key in keys:
+                    pipe.incr(f"{self._key(key)}:version")
+                    pipe.expire(f"{self._key(key)}:version", VERSION_TTL)
+                await pipe.execute()
+            await self.redis.publish(self.channel, json.dumps(list(keys)))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to invalidate {keys} in Redis: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                # Anything published while we were disconnected is lost, so start clean
+                self._l1_drop(list(self._l1))
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._l1_drop(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener failed, reconnecting: {e}")
+                await asyncio.sleep(1)
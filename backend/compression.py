@@ -0,0 +1,237 @@
+"""zstd compression of stored document content.
+
+Inline documents keep compressed bytes in ``content`` (instead of base64 ``file_data``) and
+blob files get a ``.zst`` suffix; either way the document's ``codec`` says how it's stored.
+Formats that are already compressed are detected from the declared MIME type and the
+file's magic bytes and stored as-is.
+"""
+import asyncio
+import base64
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator, Optional
+
+import typer
+import zstandard
+from dotenv import load_dotenv
+
+ZSTD = "zstd"
+DEFAULT_LEVEL = 6
+READ_SIZE = 1024 * 1024
+# Content that doesn't shrink below this fraction of its size is stored uncompressed
+MAX_RATIO = 0.9
+SNIFF_SIZE = 64 * 1024
+
+COMPRESSED_TYPES = (
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/heic", "image/avif",
+    "video/", "audio/",
+    "application/zip", "application/gzip", "application/x-gzip", "application/zstd",
+    "application/x-7z-compressed", "application/x-rar-compressed", "application/x-bzip2",
+    "application/x-xz", "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.", "application/epub+zip",
+)
+MAGIC = (
+    b"PK\x03\x04",  # zip, docx/xlsx/pptx, odt
+    b"\x1f\x8b",  # gzip
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"BZh",
+    b"\xfd7zXZ\x00",
+    b"7z\xbc\xaf\x27\x1c",
+    b"Rar!\x1a\x07",
+    b"\xff\xd8\xff",  # jpeg
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF8",
+    b"\x1a\x45\xdf\xa3",  # matroska/webm
+    b"OggS",
+    b"fLaC",
+    b"ID3",
+)
+
+
+def is_precompressed(file_type: str, head: bytes) -> bool:
+    if file_type.lower().startswith(COMPRESSED_TYPES) or head.startswith(MAGIC):
+        return True
+    # RIFF (webp, avi, wav) and ISO media (mp4, mov, heic) carry their type further in
+    return (head[:4] == b"RIFF" and head[8:12] in (b"WEBP", b"AVI ")) or head[4:8] == b"ftyp"
+
+
+def worth_compressing(file_type: str, head: bytes) -> bool:
+    """Skip known compressed formats, then check that a sample actually shrinks."""
+    if not head or is_precompressed(file_type, head):
+        return False
+    sample = head[:SNIFF_SIZE]
+    return len(zstandard.ZstdCompressor(level=1).compress(sample)) < len(sample) * MAX_RATIO
+
+
+def level() -> int:
+    # Read per compressor, not at import: server.py imports this module before loading .env
+    return int(os.environ.get('ZSTD_LEVEL', DEFAULT_LEVEL))
+
+
+def compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=level()).compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def encode_content(file_type: str, data: bytes) -> dict:
+    """Storage fields for an inline document's raw bytes."""
+    if worth_compressing(file_type, data):
+        compressed = compress(data)
+        if len(compressed) < len(data) * MAX_RATIO:
+            return {"content": compressed, "codec": ZSTD, "size": len(data), "stored_size": len(compressed)}
+    return {"content": data, "codec": None, "size": len(data), "stored_size": len(data)}
+
+
+def decode_content(document: dict) -> bytes:
+    if document.get("codec") == ZSTD:
+        return decompress(document["content"])
+    return bytes(document["content"])
+
+
+def compress_file(source: Path, target: Path) -> int:
+    """Stream ``source`` into a zstd frame at ``target``; returns the compressed size."""
+    # Large files are split across cores; the output is still a single standard frame
+    threads = -1 if source.stat().st_size > 64 * READ_SIZE else 0
+    compressor = zstandard.ZstdCompressor(level=level(), threads=threads, write_content_size=True)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        compressor.copy_stream(src, dst, size=source.stat().st_size, read_size=READ_SIZE, write_size=READ_SIZE)
+        dst.flush()
+        os.fsync(dst.fileno())
+    return target.stat().st_size
+
+
+def read_head(path: Path, size: int = SNIFF_SIZE) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+def compress_file_if_worthwhile(source: Path, target: Path, file_type: str) -> Optional[int]:
+    """Write a compressed copy of ``source`` to ``target`` if it pays off; returns its size."""
+    size = source.stat().st_size
+    if not worth_compressing(file_type, read_head(source)):
+        return None
+    stored = compress_file(source, target)
+    if stored >= size * MAX_RATIO:
+        target.unlink(missing_ok=True)
+        return None
+    return stored
+
+
+def compress_blob(store, blob_id: str, file_type: str) -> Optional[int]:
+    """Replace a raw blob with a compressed one; returns the compressed size, or None if kept raw."""
+    raw = store.path(blob_id)
+    target = store.path(blob_id, ZSTD)
+    partial = target.with_name(target.name + ".partial")
+    stored = compress_file_if_worthwhile(raw, partial, file_type)
+    if stored is None:
+        return None
+    os.replace(partial, target)
+    # Readers that already opened the raw file keep reading it; new ones find the .zst
+    raw.unlink(missing_ok=True)
+    return stored
+
+
+def iter_file(path: Path, codec: Optional[str]) -> Iterator[bytes]:
+    """Yield a blob's original bytes in bounded chunks, decompressing on the fly."""
+    with open(path, "rb") as f:
+        if codec == ZSTD:
+            yield from zstandard.ZstdDecompressor().read_to_iter(f, read_size=READ_SIZE, write_size=READ_SIZE)
+            return
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                return
+            yield data
+
+
+class Ratios:
+    """Stored vs original bytes, per MIME type."""
+
+    def __init__(self):
+        self.by_type = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, file_type: str, original: int, stored: int):
+        entry = self.by_type[file_type]
+        entry[0] += 1
+        entry[1] += original
+        entry[2] += stored
+
+    def report(self) -> str:
+        lines = [f"{'file_type':<50}{'docs':>8}{'original':>16}{'stored':>16}{'ratio':>8}"]
+        total = [0, 0, 0]
+        for file_type, (count, original, stored) in sorted(self.by_type.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{file_type[:49]:<50}{count:>8}{original:>16,}{stored:>16,}{stored / max(original, 1):>8.2f}")
+            total = [total[0] + count, total[1] + original, total[2] + stored]
+        lines.append(f"{'total':<50}{total[0]:>8}{total[1]:>16,}{total[2]:>16,}{total[2] / max(total[1], 1):>8.2f}")
+        return "\n".join(lines)
+
+
+async def backfill(db, store, batch_size: int = 100, dry_run: bool = False) -> Ratios:
+    """Compress existing inline documents and blob files that were stored raw."""
+    ratios = Ratios()
+    cursor = db.documents.find({"file_data": {"$ne": None}, "codec": {"$exists": False}},
+                               {"_id": 1, "file_type": 1, "file_data": 1})
+    async for document in cursor.batch_size(batch_size):
+        data = base64.b64decode(document["file_data"])
+        fields = await asyncio.to_thread(encode_content, document["file_type"], data)
+        ratios.add(document["file_type"], len(data), fields["stored_size"])
+        if not dry_run:
+            await db.documents.update_one({"_id": document["_id"], "file_data": {"$ne": None}},
+                                          {"$set": fields, "$unset": {"file_data": ""}})
+
+    seen = set()
+    async for document in db.documents.find({"blob_id": {"$ne": None}, "stored_size": {"$exists": False}},
+                                            {"_id": 0, "blob_id": 1, "file_type": 1, "size": 1}):
+        blob_id = document["blob_id"]
+        if blob_id in seen:
+            continue
+        seen.add(blob_id)
+        path, codec = store.locate(blob_id)
+        if path is None:
+            continue
+        stored = path.stat().st_size
+        size = document.get("size") or stored
+        if codec is None and dry_run:
+            # Estimate from the first few megabytes rather than compressing the whole file
+            sample = await asyncio.to_thread(read_head, path, 4 * READ_SIZE)
+            if sample and worth_compressing(document["file_type"], sample):
+                stored = min(size, size * len(await asyncio.to_thread(compress, sample)) // len(sample))
+        elif codec is None:
+            compressed = await asyncio.to_thread(compress_blob, store, blob_id, document["file_type"])
+            if compressed is not None:
+                codec, stored = ZSTD, compressed
+        ratios.add(document["file_type"], size, stored)
+        if not dry_run:
+            await db.documents.update_many({"blob_id": blob_id}, {"$set": {"codec": codec, "stored_size": stored}})
+    return ratios
+
+
+cli = typer.Typer(help="Compress stored document content.")
+
+
+@cli.command("backfill")
+def backfill_command(
+    batch_size: int = typer.Option(100, help="Inline documents fetched per batch"),
+    dry_run: bool = typer.Option(False, help="Measure ratios without rewriting anything (blobs are sampled)"),
+    tenant: Optional[str] = typer.Option(None, help="Tenant to compress; all registered tenants by default"),
+):
+    """Compress existing documents and print compression ratios per MIME type."""
+    import tenancy
+    from server import blob_store, db, tenants
+
+    async def run():
+        for tenant_id in [tenant] if tenant else await tenants.ids():
+            with tenancy.use_tenant(tenant_id):
+                ratios = await backfill(db, blob_store, batch_size, dry_run)
+            typer.echo(f"{tenant_id}:\n{ratios.report()}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    cli()
@@ -0,0 +1,147 @@
+"""``court_date_view``: court dates with the case, client and attorney fields every listing shows.
+
+Writers keep it in step incrementally: a new hearing is upserted with its case context, a case
+update rewrites the embedded fields of that case's hearings in one ``update_many``, and
+deletes and archival remove the case's rows. Readers get a hearing list, calendar or dashboard
+from a single indexed query with no per-row lookups. ``rebuild`` recomputes it from the
+source collections to repair drift, e.g. after restoring a backup.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import typer
+from dotenv import load_dotenv
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+COURT_DATE_VIEW = "court_date_view"
+BATCH_SIZE = 1000
+# Hidden from API responses
+PROJECTION = {"_id": 0, "synced_at": 0}
+
+
+async def _names(collection, ids: Iterable[str]) -> Dict[str, str]:
+    ids = list({i for i in ids if i})
+    if not ids:
+        return {}
+    return {doc["id"]: doc["name"] async for doc in collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "name": 1})}
+
+
+async def case_contexts(db, cases: List[dict]) -> Dict[str, dict]:
+    """The embedded fields for each case, keyed by case id."""
+    clients, attorneys = await asyncio.gather(
+        _names(db.clients, (case["client_id"] for case in cases)),
+        _names(db.users, (case["assigned_attorney"] for case in cases)),
+    )
+    return {
+        case["id"]: {
+            "case_title": case["title"],
+            "case_number": case["case_number"],
+            "client_id": case["client_id"],
+            "client_name": clients.get(case["client_id"]),
+            "assigned_attorney": case["assigned_attorney"],
+            "attorney_name": attorneys.get(case["assigned_attorney"]),
+        }
+        for case in cases
+    }
+
+
+async def _upsert(db, rows: List[dict], synced_at: datetime):
+    if rows:
+        await db[COURT_DATE_VIEW].bulk_write(
+            [ReplaceOne({"id": row["id"]}, {**row, "synced_at": synced_at}, upsert=True) for row in rows],
+            ordered=False,
+        )
+
+
+async def add_court_dates(db, case: dict, court_dates: List[dict]):
+    context = (await case_contexts(db, [case]))[case["id"]]
+    rows = [{k: v for k, v in court_date.items() if k != "_id"} | context for court_date in court_dates]
+    await _upsert(db, rows, datetime.utcnow())
+
+
+async def add_case(db, case: dict):
+    """Add every hearing of ``case``, e.g. after it's restored from the archive."""
+    court_dates = await db.court_dates.find({"case_id": case["id"]}, {"_id": 0}).to_list(None)
+    await add_court_dates(db, case, court_dates)
+
+
+async def update_cases(db, case_ids: List[str], patch: dict):
+    """Apply a case patch to the embedded fields of those cases' hearings."""
+    fields = {}
+    if "title" in patch:
+        fields["case_title"] = patch["title"]
+    if "assigned_attorney" in patch:
+        fields["assigned_attorney"] = patch["assigned_attorney"]
+        fields["attorney_name"] = (await _names(db.users, [patch["assigned_attorney"]])).get(patch["assigned_attorney"])
+    if fields and case_ids:
+        await db[COURT_DATE_VIEW].update_many({"case_id": {"$in": case_ids}},
+                                              {"$set": {**fields, "synced_at": datetime.utcnow()}})
+
+
+async def remove_court_date(db, court_date_id: str):
+    await db[COURT_DATE_VIEW].delete_one({"id": court_date_id})
+
+
+async def remove_case(db, case_id: str):
+    await db[COURT_DATE_VIEW].delete_many({"case_id": case_id})
+
+
+async def rebuild(db, batch_size: int = BATCH_SIZE) -> int:
+    """Recompute every row from court_dates, cases, clients and users; returns the row count.
+
+    Safe to run while serving: rows are replaced in place, and anything not written by this run
+    or a concurrent writer since it started is removed at the end.
+    """
+    started = datetime.utcnow()
+    rows = 0
+    batch: List[dict] = []
+
+    async def flush():
+        case_ids = list({court_date["case_id"] for court_date in batch})
+        cases = await db.cases.find({"id": {"$in": case_ids}}, {"_id": 0}).to_list(None)
+        contexts = await case_contexts(db, cases)
+        # Hearings whose case is gone are orphans and are left out
+        await _upsert(db, [court_date | contexts[court_date["case_id"]] for court_date in batch
+                           if court_date["case_id"] in contexts], started)
+        return sum(1 for court_date in batch if court_date["case_id"] in contexts)
+
+    async for court_date in db.court_dates.find({}, {"_id": 0}).batch_size(batch_size):
+        batch.append(court_date)
+        if len(batch) >= batch_size:
+            rows += await flush()
+            batch = []
+    if batch:
+        rows += await flush()
+    removed = await db[COURT_DATE_VIEW].delete_many({"synced_at": {"$lt": started}})
+    logger.info(f"Rebuilt {COURT_DATE_VIEW}: {rows} rows, {removed.deleted_count} stale rows removed")
+    return rows
+
+
+cli = typer.Typer(help="Maintain the denormalized court date view.")
+
+
+@cli.command("rebuild")
+def rebuild_command(
+    tenant: Optional[str] = typer.Option(None, help="Tenant to rebuild; all registered tenants by default"),
+    batch_size: int = typer.Option(BATCH_SIZE, help="Court dates per bulk write"),
+):
+    """Recompute the view from the source collections."""
+    import tenancy
+    from server import db, tenants
+
+    async def run():
+        for tenant_id in [tenant] if tenant else await tenants.ids():
+            with tenancy.use_tenant(tenant_id):
+                typer.echo(f"{tenant_id}: {await rebuild(db, batch_size)} rows")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    cli()
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import Binary
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tenancy import current_tenant
+
+logger = logging.getLogger(__name__)
+
+# Larger responses are stored with their bulky fields left out, e.g. a document's file_data
+MAX_STORED_BODY = 1024 * 1024
+# Top-level JSON values above this size are the ones left out
+MAX_REDACTED_VALUE = 1024
+# Bodies beyond this aren't even buffered for redaction; only the status is kept
+MAX_CAPTURED_BODY = 64 * 1024 * 1024
+
+
+def storable_body(body: bytes, content_type: Optional[str]) -> Tuple[bytes, List[str]]:
+    """The body to keep for replay, and the top-level fields left out to fit ``MAX_STORED_BODY``."""
+    if len(body) <= MAX_STORED_BODY:
+        return body, []
+    if content_type and content_type.startswith("application/json"):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            redacted = [field for field, value in data.items() if len(json.dumps(value)) > MAX_REDACTED_VALUE]
+            smaller = json.dumps({field: value for field, value in data.items() if field not in redacted}).encode()
+            if len(smaller) <= MAX_STORED_BODY:
+                return smaller, redacted
+    return b"", ["*"]
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response when a POST is retried with the same ``Idempotency-Key``.
+
+    The first request claims the key with a single upsert on ``_id``; a retry costs that one
+    indexed lookup and gets the original status and body back. Duplicates that arrive while
+    the first request is still running wait for it (in-process via an event, across workers
+    by polling) instead of running twice. The owner renews its claim while it runs, so only a
+    claim left behind by a dead worker is ever taken over, however long the request takes.
+    5xx responses and failures release the key so the client can retry for real; any other
+    response keeps it, however large. Oversized bodies are replayed without their bulky
+    fields, listed in ``Idempotent-Redacted``. Reusing a key with a different body is
+    rejected with 422.
+    """
+
+    def __init__(self, app: ASGIApp, collection, paths: Iterable[str], ttl: timedelta = timedelta(hours=24),
+                 lock_timeout: timedelta = timedelta(seconds=60), wait_timeout: float = 30.0):
+        self.app = app
+        self.collection = collection
+        self.paths = set(paths)
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self._inflight: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > 255:
+            await JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)(scope, receive, send)
+            return
+        record_id = f"{scope['path']}:{key}"
+        owner = str(uuid.uuid4())
+        record = await self._claim(record_id, owner)
+        if record is None:
+            await self._execute(record_id, owner, scope, receive, send)
+            return
+
+        fingerprint = await self._fingerprint(receive)
+        try:
+            record = await self._wait(record_id, record)
+        except asyncio.TimeoutError:
+            record = {"status": "in_progress"}
+        if record is None:
+            # The first attempt failed and released the key
+            response = JSONResponse({"detail": "The original request failed; retry it"},
+                                    status_code=409, headers={"Retry-After": "1"})
+        elif record["status"] == "in_progress":
+            response = JSONResponse({"detail": "A request with this Idempotency-Key is still in progress"},
+                                    status_code=409, headers={"Retry-After": "1"})
+        elif record.get("fingerprint") != fingerprint:
+            response = JSONResponse({"detail": "Idempotency-Key was already used for a different request"},
+                                    status_code=422)
+        else:
+            stored = record["response"]
+            headers = {"Idempotent-Replayed": "true"}
+            if stored.get("redacted"):
+                headers["Idempotent-Redacted"] = ",".join(stored["redacted"])
+            response = Response(bytes(stored["body"]), status_code=stored["status"],
+                                media_type=stored.get("content_type"), headers=headers)
+        await response(scope, receive, send)
+
+    async def _claim(self, record_id: str, owner: str) -> Optional[dict]:
+        """Returns None if this request now owns the key, otherwise the existing record."""
+        now = datetime.utcnow()
+        record = await self.collection.find_one_and_update(
+            {"_id": record_id},
+            {"$setOnInsert": {"status": "in_progress", "owner": owner, "created_at": now,
+                              "expires_at": now + self.ttl}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if record is None or record["status"] != "in_progress" or record["created_at"] > now - self.lock_timeout:
+            return record
+        # The owner died mid-request; take the key over
+        taken = await self.collection.find_one_and_update(
+            {"_id": record_id, "owner": record["owner"], "status": "in_progress"},
+            {"$set": {"owner": owner, "created_at": now}},
+        )
+        return None if taken else record
+
+    async def _execute(self, record_id: str, owner: str, scope: Scope, receive: Receive, send: Send):
+        inflight_key = f"{current_tenant.get()}:{record_id}"
+        done = self._inflight[inflight_key] = asyncio.Event()
+        hasher = hashlib.sha256()
+        status = None
+        content_type = None
+        body = bytearray()
+        complete = False
+
+        async def hashing_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                hasher.update(message.get("body", b""))
+            return message
+
+        async def capturing_send(message: Message):
+            nonlocal status, content_type, body, complete
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = Headers(raw=message["headers"]).get("content-type")
+            elif message["type"] == "http.response.body":
+                if body is not None:
+                    body += message.get("body", b"")
+                    if len(body) > MAX_CAPTURED_BODY:
+                        body = None
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        renewal = asyncio.create_task(self._renew(record_id, owner))
+        try:
+            await self.app(scope, hashing_receive, capturing_send)
+        finally:
+            renewal.cancel()
+            try:
+                if complete and status < 500:
+                    stored, redacted = storable_body(bytes(body), content_type) if body is not None else (b"", ["*"])
+                    if redacted:
+                        logger.info(f"Stored idempotent response for {record_id} without {redacted}")
+                    await self.collection.update_one(
+                        {"_id": record_id, "owner": owner},
+                        {"$set": {
+                            "status": "complete",
+                            "fingerprint": hasher.hexdigest(),
+                            "response": {"status": status, "content_type": content_type, "body": Binary(stored),
+                                         "redacted": redacted},
+                        }},
+                    )
+                else:
+                    await self.collection.delete_one({"_id": record_id, "owner": owner})
+            except Exception as e:
+                logger.warning(f"Could not store idempotent response for {record_id}: {e}")
+            finally:
+                if self._inflight.get(inflight_key) is done:
+                    del self._inflight[inflight_key]
+                done.set()
+
+    async def _renew(self, record_id: str, owner: str):
+        """Keep the claim fresh so retries never mistake a slow request for a dead one."""
+        while True:
+            await asyncio.sleep(self.lock_timeout.total_seconds() / 3)
+            try:
+                await self.collection.update_one({"_id": record_id, "owner": owner, "status": "in_progress"},
+                                                 {"$set": {"created_at": datetime.utcnow()}})
+            except Exception as e:
+                logger.warning(f"Could not renew idempotency claim {record_id}: {e}")
+
+    async def _wait(self, record_id: str, record: dict) -> Optional[dict]:
+        """Wait for an in-progress request with the same key to finish; None if it released the key."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = 0.05
+        while record is not None and record["status"] == "in_progress":
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            # Records live in each tenant's database, but waiters share this process
+            event = self._inflight.get(f"{current_tenant.get()}:{record_id}")
+            if event is not None:
+                await asyncio.wait_for(event.wait(), remaining)
+            else:
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, 1.0)
+            record = await self.collection.find_one({"_id": record_id})
+        return record
+
+    async def _fingerprint(self, receive: Receive) -> str:
+        hasher = hashlib.sha256()
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            hasher.update(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return hasher.hexdigest()
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # gzip-only when the brotli wheel isn't available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class ETagMiddleware:
+    """Adds a weak ETag to complete GET responses and answers matching If-None-Match with 304.
+
+    The tag is computed over the uncompressed body, so it must sit inside CompressionMiddleware.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start: Optional[Message] = None
+        streaming = False
+
+        async def send_with_etag(message: Message):
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                # Streamed responses pass through untouched
+                streaming = True
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            if start["status"] == 200 and "etag" not in headers:
+                headers["ETag"] = 'W/"' + hashlib.blake2b(message.get("body", b""), digest_size=16).hexdigest() + '"'
+            etag = headers.get("etag")
+            if etag and if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                not_modified = MutableHeaders(raw=[(k, v) for k, v in start["headers"]
+                                                   if k.lower() not in (b"content-length", b"content-type")])
+                await send({"type": "http.response.start", "status": 304, "headers": not_modified.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class CompressionMiddleware:
+    """Negotiates brotli or gzip for text/JSON responses above ``minimum_size`` bytes."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start: Optional[Message] = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if not content_type.startswith(COMPRESSIBLE_TYPES) or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                MutableHeaders(scope=start).add_vary_header("Accept-Encoding")
+                if encoding is None:
+                    passthrough = True
+                    await send(start)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(scope=start)
+                headers["Content-Encoding"] = encoding
+                if not more_body:
+                    body = self.compress(encoding, body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                compressor = self.compressor(encoding)
+                await send(start)
+            chunk = compressor.process(body) if encoding == "br" else compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish() if encoding == "br" else compressor.flush()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, mode=brotli.MODE_TEXT, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def compressor(self, encoding: str):
+        if encoding == "br":
+            return brotli.Compressor(mode=brotli.MODE_TEXT, quality=self.brotli_quality)
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
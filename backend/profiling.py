@@ -0,0 +1,331 @@
+"""On-demand sampling profiler for single requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILE_TOKEN>`` or is picked by
+``PROFILE_SAMPLE_RATE``. While it runs, a sampler thread looks at the request's task every
+``interval``: if the task is running, the event loop thread's stack is recorded and classified
+as validation, serialization, response compression or application code; if it is suspended, the stack it is awaiting
+in is recorded as a Mongo wait (a command of this request is in flight), another wait, or
+``loop_busy`` (ready to run but queued behind other requests). Mongo time is also measured
+exactly by ``CommandTimer``, which motor's executor threads run with the request's context.
+
+Finished profiles are stored with their folded stacks, ready for flamegraph.pl or speedscope,
+in a capped Mongo collection shared by every worker, so ``X-Profile-Id`` can be looked up from
+any of them. Reading them needs the token, so sampling needs one too. Requests that aren't
+profiled only pay for the header check.
+"""
+import asyncio
+import hmac
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tenancy import current_tenant
+
+logger = logging.getLogger(__name__)
+
+current_profile: ContextVar[Optional["Profile"]] = ContextVar("current_profile", default=None)
+
+# Checked outermost first, so pydantic work inside response serialization counts as serialization
+SERIALIZATION = ("fastapi.encoders:", "fastapi.routing:serialize_response", "starlette.responses:render", "json.")
+VALIDATION = ("pydantic", "fastapi.dependencies.utils:", "fastapi.routing:_validate")
+# Response compression runs in the request's task as the body is sent
+COMPRESSION = ("middleware:compress", "brotli", "gzip", "zlib")
+MONGO = ("motor.", "pymongo.", "bson.")
+CATEGORIES = ("mongo", "validation", "serialization", "compression", "app", "waiting", "loop_busy")
+MAX_COMMANDS = 200
+# Fields of a stored profile that make up its summary
+SUMMARY_FIELDS = ("id", "method", "path", "tenant", "status", "started_at", "wall_ms", "mongo_ms",
+                  "mongo_commands", "samples", "sampled_ms")
+
+_labels: Dict[object, str] = {}
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for marker in ("site-packages/", "dist-packages/", "/lib/python"):
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+                if marker == "/lib/python":
+                    filename = filename.split("/", 1)[-1]
+                break
+        else:
+            filename = filename.rsplit("/", 1)[-1]
+        module = filename.removesuffix(".py").replace("/", ".").removesuffix(".__init__")
+        label = _labels[code] = f"{module}:{code.co_name}"
+    return label
+
+
+class Profile:
+    def __init__(self, method: str, path: str, interval: float, task: asyncio.Task, loop_thread: int):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.tenant = current_tenant.get()
+        self.interval = interval
+        self.task = task
+        self.loop = task.get_loop()
+        self.loop_thread = loop_thread
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self.status: Optional[int] = None
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.commands: List[tuple] = []
+        self.command_count = 0
+        self.mongo_seconds = 0.0
+        self.mongo_in_flight = 0
+        # Commands of one request can run on several executor threads at once
+        self._lock = threading.Lock()
+
+    def command_started(self):
+        with self._lock:
+            self.mongo_in_flight += 1
+
+    def command_finished(self, name: str, duration_micros: int):
+        with self._lock:
+            self.mongo_in_flight -= 1
+            self.command_count += 1
+            self.mongo_seconds += duration_micros / 1e6
+            if len(self.commands) < MAX_COMMANDS:
+                self.commands.append((name, duration_micros / 1000))
+
+    def sample(self, frames: dict):
+        if asyncio.current_task(self.loop) is self.task:
+            stack = self._running_stack(frames.get(self.loop_thread))
+            category = self._classify(stack)
+        else:
+            stack = self._awaiting_stack()
+            if self.mongo_in_flight > 0:
+                category = "mongo"
+            elif getattr(self.task, "_fut_waiter", True) is None:
+                category = "loop_busy"
+            else:
+                category = "waiting"
+            stack.append(f"<{category}>")
+        self.stacks[";".join(stack)] += 1
+        self.categories[category] += 1
+
+    @staticmethod
+    def _running_stack(frame) -> List[str]:
+        stack = []
+        while frame is not None:
+            label = _label(frame.f_code)
+            # Everything below the callback that resumed the task is event loop machinery
+            if label.startswith("asyncio.events:_run"):
+                break
+            stack.append(label)
+            frame = frame.f_back
+        return stack[::-1]
+
+    def _awaiting_stack(self) -> List[str]:
+        stack = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(_label(frame.f_code))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return stack
+
+    @staticmethod
+    def _classify(stack: List[str]) -> str:
+        for label in stack:
+            if label.startswith(COMPRESSION):
+                return "compression"
+        for label in stack:
+            if label.startswith(SERIALIZATION):
+                return "serialization"
+        for label in stack:
+            if label.startswith(VALIDATION):
+                return "validation"
+        if stack and stack[-1].startswith(MONGO):
+            return "mongo"
+        return "app"
+
+    def finish(self, status: Optional[int]):
+        self.wall = time.perf_counter() - self.started
+        self.status = status
+
+    def summary(self) -> dict:
+        sampled = {category: round(self.categories[category] * self.interval * 1000, 1) for category in CATEGORIES}
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "tenant": self.tenant,
+            "status": self.status,
+            "started_at": self.started_at,
+            "wall_ms": round(self.wall * 1000, 1),
+            "mongo_ms": round(self.mongo_seconds * 1000, 1),
+            "mongo_commands": self.command_count,
+            "samples": sum(self.categories.values()),
+            "sampled_ms": sampled,
+        }
+
+    def detail(self, top: int = 20) -> dict:
+        return {
+            **self.summary(),
+            "interval_ms": self.interval * 1000,
+            "commands": [{"name": name, "ms": round(ms, 2)} for name, ms in self.commands],
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(top)],
+        }
+
+    def folded(self) -> str:
+        """Collapsed stacks, one ``frame;frame;... count`` line each."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Adds each Mongo command's server round trip to the profile of the request that ran it."""
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_started()
+
+    def succeeded(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event.command_name, event.duration_micros)
+
+    def failed(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event.command_name, event.duration_micros)
+
+
+def matches_token(value: Optional[str], token: str) -> bool:
+    return hmac.compare_digest((value or "").encode(), token.encode())
+
+
+async def create_store(database, name: str, max_profiles: int, size: int = 64 * 1024 * 1024):
+    """The capped collection profiles are stored in; capped, so old ones go without a cleanup job."""
+    if name not in await database.list_collection_names():
+        try:
+            await database.create_collection(name, capped=True, size=size, max=max_profiles)
+        except CollectionInvalid:
+            # Created by another worker in the meantime
+            pass
+    return database[name]
+
+
+class Profiler:
+    """Runs the sampler thread while any profile is active and stores finished ones in ``collection``,
+    which keeps the last ``max_profiles`` (see ``create_store``)."""
+
+    def __init__(self, collection, interval: float = 0.005, max_profiles: int = 100):
+        self.collection = collection
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self._active: List[Profile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self, method: str, path: str) -> Profile:
+        profile = Profile(method, path, self.interval, asyncio.current_task(), threading.get_ident())
+        with self._lock:
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    async def end(self, profile: Profile, status: Optional[int]):
+        with self._lock:
+            self._active.remove(profile)
+        profile.finish(status)
+        try:
+            await self.collection.insert_one({"_id": profile.id, **profile.detail(), "folded": profile.folded()})
+        except Exception as e:
+            logger.warning(f"Could not store profile {profile.id}: {e}")
+
+    async def list(self) -> List[dict]:
+        """Summaries of the stored profiles, newest first."""
+        cursor = self.collection.find({}, {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}})
+        return await cursor.sort("$natural", -1).to_list(self.max_profiles)
+
+    async def get(self, profile_id: str, folded: bool = False):
+        """The profile's detail, or its folded stacks; None if it isn't stored (any more)."""
+        projection = {"_id": 0, "folded": 1} if folded else {"_id": 0, "folded": 0}
+        stored = await self.collection.find_one({"_id": profile_id}, projection)
+        if stored is None:
+            return None
+        return stored["folded"] if folded else stored
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wake.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in active:
+                try:
+                    profile.sample(frames)
+                except Exception:
+                    # The task's coroutine chain changed under us; skip this tick
+                    pass
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfilingMiddleware:
+    """Profiles requests sent with ``X-Profile: <token>`` or picked at ``sample_rate``.
+
+    The response of a profiled request carries ``X-Profile-Id`` for looking the profile up.
+    Must sit inside admission control, which runs the request in its own task.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: Profiler, token: Optional[str] = None, sample_rate: float = 0.0):
+        if sample_rate and not token:
+            raise ValueError("Sampled profiles can only be read with the profile token; set one")
+        self.app = app
+        self.profiler = profiler
+        self.token = token
+        self.sample_rate = sample_rate
+
+    def _wanted(self, scope: Scope) -> bool:
+        if self.token and matches_token(Headers(scope=scope).get("x-profile"), self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not (self.token or self.sample_rate) or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.begin(scope["method"], scope["path"])
+        status = None
+
+        async def send_with_id(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile.id)
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_profile.reset(token)
+            await self.profiler.end(profile, status)
@@ -0,0 +1,279 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from tenancy import DEFAULT_TENANT, current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+# Heap entry layout; entries are lists so cancellation can flip VALID in place
+FIRE_AT, SEQ, COURT_DATE_ID, LEAD, CASE_ID, VALID, TENANT = range(7)
+# Court dates per outbox lookup when reloading the window
+LOAD_BATCH_SIZE = 1000
+# Webhook retries back off exponentially up to this
+MAX_RETRY_BACKOFF = timedelta(hours=1)
+
+
+def naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def reminder_id(court_date_id: str, lead: timedelta) -> str:
+    return f"{court_date_id}:{int(lead.total_seconds() // 60)}"
+
+
+class ReminderScheduler:
+    """Fires reminders ahead of court dates from an in-memory min-heap.
+
+    Only hearings inside ``horizon`` are held in memory; the window is reloaded every
+    ``refresh_interval``. Schedule is O(log n) per lead time and cancellation is O(1)
+    (entries are tombstoned and skipped when popped). Each reminder is written to the
+    outbox with a deterministic ``_id``, so restarts and multiple workers never dispatch
+    the same reminder twice. Webhook delivery, when configured, drains the outbox and retries
+    failures with exponential backoff from ``retry_backoff``.
+    One heap serves every tenant; each entry carries the tenant it is dispatched for.
+    """
+
+    def __init__(self, db, lead_times: List[timedelta], horizon: timedelta = timedelta(days=7),
+                 refresh_interval: timedelta = timedelta(hours=1), webhook_url: Optional[str] = None,
+                 max_attempts: int = 5, retry_backoff: timedelta = timedelta(minutes=1),
+                 tenants: Optional[Callable[[], Awaitable[List[str]]]] = None):
+        self.db = db
+        self.lead_times = sorted(lead_times, reverse=True)
+        self.horizon = horizon
+        self.refresh_interval = refresh_interval
+        self.webhook_url = webhook_url
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.tenants = tenants
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+        self._by_court_date: Dict[str, List[list]] = {}
+        self._by_case: Dict[str, Set[str]] = {}
+        self._tombstones = 0
+        self._wake = asyncio.Event()
+        self._window_end = datetime.min
+        self._tasks: List[asyncio.Task] = []
+        self.dispatched = 0
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._tombstones
+
+    async def start(self):
+        self._tasks.append(asyncio.create_task(self._run()))
+        if self.webhook_url:
+            self._tasks.append(asyncio.create_task(self._deliver()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def schedule(self, court_date: dict, dispatched: Set[str] = frozenset()):
+        """Queue the hearing's reminders, except those whose ids are in ``dispatched``."""
+        court_date_id = court_date["id"]
+        if court_date_id in self._by_court_date:
+            return
+        hearing_at = naive_utc(court_date["date"])
+        entries = []
+        for lead in self.lead_times:
+            fire_at = hearing_at - lead
+            if fire_at > self._window_end:
+                # Picked up by a later window reload
+                continue
+            if reminder_id(court_date_id, lead) in dispatched:
+                continue
+            entry = [fire_at, next(self._seq), court_date_id, lead, court_date["case_id"], True, current_tenant.get()]
+            heapq.heappush(self._heap, entry)
+            entries.append(entry)
+        if not entries:
+            return
+        self._by_court_date[court_date_id] = entries
+        self._by_case.setdefault(court_date["case_id"], set()).add(court_date_id)
+        if entries[0] is self._heap[0]:
+            self._wake.set()
+
+    def _forget(self, court_date_id: str, case_id: str):
+        self._by_court_date.pop(court_date_id, None)
+        case_ids = self._by_case.get(case_id)
+        if case_ids is not None:
+            case_ids.discard(court_date_id)
+            if not case_ids:
+                del self._by_case[case_id]
+
+    def cancel(self, court_date_id: str):
+        entries = self._by_court_date.get(court_date_id)
+        if not entries:
+            return
+        self._forget(court_date_id, entries[0][CASE_ID])
+        for entry in entries:
+            if entry[VALID]:
+                entry[VALID] = False
+                self._tombstones += 1
+        # Rebuild once tombstones dominate so memory tracks live reminders
+        if self._tombstones > 1024 and self._tombstones > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[VALID]]
+            heapq.heapify(self._heap)
+            self._tombstones = 0
+
+    def cancel_case(self, case_id: str):
+        for court_date_id in list(self._by_case.get(case_id, ())):
+            self.cancel(court_date_id)
+
+    async def _tenant_ids(self) -> List[str]:
+        return await self.tenants() if self.tenants else [DEFAULT_TENANT]
+
+    async def _load_window(self):
+        now = datetime.utcnow()
+        self._window_end = now + self.horizon
+        for tenant in await self._tenant_ids():
+            with use_tenant(tenant):
+                cursor = self.db.court_dates.find(
+                    {"date": {"$gte": now, "$lte": self._window_end + self.lead_times[0]}},
+                    {"_id": 0, "id": 1, "case_id": 1, "date": 1},
+                )
+                batch = []
+                async for court_date in cursor:
+                    batch.append(court_date)
+                    if len(batch) >= LOAD_BATCH_SIZE:
+                        await self._schedule_batch(batch, now)
+                        batch = []
+                if batch:
+                    await self._schedule_batch(batch, now)
+        logger.info(f"Reminder window loaded: {len(self)} reminders until {self._window_end}")
+
+    async def _schedule_batch(self, court_dates: List[dict], now: datetime):
+        # Leads already due were either dispatched before, or missed while no worker ran;
+        # only the missed ones are queued again
+        due = [
+            reminder_id(court_date["id"], lead)
+            for court_date in court_dates
+            if court_date["id"] not in self._by_court_date
+            for lead in self.lead_times
+            if naive_utc(court_date["date"]) - lead <= now
+        ]
+        dispatched = set()
+        if due:
+            dispatched = {doc["_id"] async for doc in self.db.reminder_outbox.find({"_id": {"$in": due}}, {"_id": 1})}
+        for court_date in court_dates:
+            self.schedule(court_date, dispatched)
+
+    async def _run(self):
+        next_refresh = datetime.min
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= next_refresh:
+                    await self._load_window()
+                    next_refresh = now + self.refresh_interval
+                while self._heap and self._heap[0][FIRE_AT] <= now:
+                    entry = heapq.heappop(self._heap)
+                    if not entry[VALID]:
+                        self._tombstones -= 1
+                        continue
+                    entries = self._by_court_date.get(entry[COURT_DATE_ID], [])
+                    entries[:] = [other for other in entries if other is not entry]
+                    if not entries:
+                        self._forget(entry[COURT_DATE_ID], entry[CASE_ID])
+                    with use_tenant(entry[TENANT]):
+                        await self._dispatch(entry)
+                wake_at = next_refresh
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][FIRE_AT])
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, (wake_at - datetime.utcnow()).total_seconds()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Reminder scheduler error, retrying: {e}")
+                await asyncio.sleep(5)
+
+    async def _dispatch(self, entry: list):
+        # Another worker may have deleted the hearing; only the database is authoritative
+        court_date = await self.db.court_dates.find_one({"id": entry[COURT_DATE_ID]}, {"_id": 0})
+        # Mongo stores milliseconds, so allow for rounding when checking the hearing didn't move
+        if not court_date or abs(naive_utc(court_date["date"]) - entry[LEAD] - entry[FIRE_AT]) > timedelta(seconds=1):
+            return
+        case = await self.db.cases.find_one({"id": court_date["case_id"]}, {"_id": 0, "title": 1, "case_number": 1})
+        lead_minutes = int(entry[LEAD].total_seconds() // 60)
+        reminder = {
+            "_id": reminder_id(court_date["id"], entry[LEAD]),
+            "court_date_id": court_date["id"],
+            "case_id": court_date["case_id"],
+            "case_title": case["title"] if case else None,
+            "case_number": case["case_number"] if case else None,
+            "court_name": court_date["court_name"],
+            "hearing_type": court_date["hearing_type"],
+            "hearing_at": court_date["date"],
+            "lead_minutes": lead_minutes,
+            "fire_at": entry[FIRE_AT],
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+        }
+        try:
+            await self.db.reminder_outbox.insert_one(reminder)
+        except DuplicateKeyError:
+            return
+        self.dispatched += 1
+
+    async def _deliver(self):
+        while True:
+            try:
+                delivered = 0
+                for tenant in await self._tenant_ids():
+                    with use_tenant(tenant):
+                        delivered += await self._deliver_one()
+                if not delivered:
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Reminder delivery error, retrying: {e}")
+                await asyncio.sleep(5)
+
+    async def _deliver_one(self) -> int:
+        # Reclaim reminders left in "sending" by a worker that died mid-delivery
+        now = datetime.utcnow()
+        stale = now - timedelta(minutes=5)
+        reminder = await self.db.reminder_outbox.find_one_and_update(
+            {"$or": [
+                # Not backing off after a failed attempt (older entries have no next_attempt_at)
+                {"status": "pending", "next_attempt_at": {"$not": {"$gt": now}}},
+                {"status": "sending", "claimed_at": {"$lt": stale}},
+            ]},
+            {"$set": {"status": "sending", "claimed_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+            sort=[("fire_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if reminder is None:
+            return 0
+        try:
+            await asyncio.to_thread(self._post, reminder)
+            update = {"status": "sent", "sent_at": datetime.utcnow()}
+        except Exception as e:
+            logger.warning(f"Reminder webhook failed for {reminder['_id']}: {e}")
+            status = "failed" if reminder["attempts"] >= self.max_attempts else "pending"
+            backoff = min(self.retry_backoff * 2 ** (reminder["attempts"] - 1), MAX_RETRY_BACKOFF)
+            update = {"status": status, "last_error": str(e), "next_attempt_at": datetime.utcnow() + backoff}
+        await self.db.reminder_outbox.update_one({"_id": reminder["_id"]}, {"$set": update})
+        return 1
+
+    def _post(self, reminder: dict):
+        body = json.dumps(reminder, default=lambda value: value.isoformat() + "Z").encode()
+        request = urllib.request.Request(self.webhook_url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
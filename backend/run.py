@@ -0,0 +1,23 @@
+import os
+
+import uvicorn
+
+
+def worker_count() -> int:
+    configured = os.environ.get("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    return os.cpu_count() or 1
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8001")),
+        workers=worker_count(),
+        proxy_headers=True,
+        forwarded_allow_ips="127.0.0.1",
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_TIMEOUT", "75")),
+        log_level=os.environ.get("LOG_LEVEL", "info"),
+    )
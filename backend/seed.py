@@ -0,0 +1,359 @@
+import asyncio
+import random
+import time
+from bisect import bisect
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Callable, Deque, Iterable, Iterator, List, Optional
+
+import typer
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+import analytics
+import archive
+import court_date_view
+from compression import encode_content
+from server import (
+    Case,
+    CaseStatus,
+    CaseType,
+    Client,
+    CourtDate,
+    Document,
+    DocumentCategory,
+    Priority,
+    User,
+    UserRole,
+)
+
+cli = typer.Typer(help="Generate synthetic users, clients, cases, court dates and documents.")
+
+# Distributions roughly matching production data
+ROLE_WEIGHTS = {UserRole.ATTORNEY: 55, UserRole.PARALEGAL: 25, UserRole.CLERK: 15, UserRole.JUDGE: 5}
+STATUS_WEIGHTS = {
+    CaseStatus.ACTIVE: 30,
+    CaseStatus.PENDING: 15,
+    CaseStatus.CLOSED: 30,
+    CaseStatus.SETTLED: 15,
+    CaseStatus.DISMISSED: 10,
+}
+CASE_TYPE_WEIGHTS = {CaseType.CIVIL: 70, CaseType.CRIMINAL: 30}
+CATEGORY_WEIGHTS = {
+    DocumentCategory.PLEADING: 20,
+    DocumentCategory.MOTION: 20,
+    DocumentCategory.ORDER: 10,
+    DocumentCategory.EVIDENCE: 20,
+    DocumentCategory.CORRESPONDENCE: 20,
+    DocumentCategory.CONTRACT: 5,
+    DocumentCategory.OTHER: 5,
+}
+PRIORITY_WEIGHTS = {Priority.LOW: 20, Priority.MEDIUM: 50, Priority.HIGH: 22, Priority.URGENT: 8}
+# Mean number of hearings per case by status
+HEARING_DENSITY = {
+    CaseStatus.ACTIVE: 4.0,
+    CaseStatus.PENDING: 2.0,
+    CaseStatus.CLOSED: 3.0,
+    CaseStatus.SETTLED: 1.5,
+    CaseStatus.DISMISSED: 1.0,
+}
+FILE_TYPES = [
+    ("pdf", "application/pdf"),
+    ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    ("txt", "text/plain"),
+    ("jpg", "image/jpeg"),
+]
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Thomas", "Taylor"]
+COMPANIES = ["Holdings", "Logistics", "Partners", "Industries", "Group", "Trust", "Foods", "Energy"]
+COURTS = ["Superior Court", "District Court", "Circuit Court", "Family Court",
+          "Appellate Court", "Probate Court", "Municipal Court", "Federal District Court"]
+JUDGES = ["Judge " + name for name in LAST_NAMES]
+HEARING_TYPES = ["Status Conference", "Motion Hearing", "Arraignment", "Pretrial Conference",
+                 "Trial", "Sentencing", "Mediation", "Deposition"]
+STREETS = ["Main St", "Oak Ave", "Maple Dr", "Cedar Ln", "Pine St", "Elm St", "Court St"]
+
+UUID4_MASK = ~((0xF000 << 64) | (0xC000 << 48)) & ((1 << 128) - 1)
+UUID4_BITS = (0x4000 << 64) | (0x8000 << 48)
+
+# Shared pool of random bytes that document payloads are sliced from
+PAYLOAD_POOL_BYTES = 8 * 1024 * 1024
+
+
+class Generator:
+    def __init__(self, seed: int, anchor: datetime):
+        self.rng = random.Random(seed)
+        self.anchor = anchor
+        self.random = self.rng.random
+        self.tables = {}
+        self.payload = self.rng.randbytes(PAYLOAD_POOL_BYTES)
+
+    # random.Random's convenience methods are the bottleneck at this volume, so everything
+    # is derived from a single random() call per draw
+    def below(self, n: int) -> int:
+        return int(self.random() * n)
+
+    def pick(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def choice(self, weights: dict) -> str:
+        table = self.tables.get(id(weights))
+        if table is None:
+            cum = list(accumulate(weights.values()))
+            table = self.tables[id(weights)] = ([member.value for member in weights], cum, cum[-1])
+        return table[0][bisect(table[1], self.random() * table[2])]
+
+    def uuid(self) -> str:
+        # Same layout as uuid.uuid4(), without building a UUID object per record
+        h = "%032x" % (self.rng.getrandbits(128) & UUID4_MASK | UUID4_BITS)
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+    def person(self) -> str:
+        return f"{self.pick(FIRST_NAMES)} {self.pick(LAST_NAMES)}"
+
+    def past(self, max_days: int) -> datetime:
+        return self.anchor - timedelta(seconds=self.below(max_days * 86400))
+
+    def phone(self) -> str:
+        return f"555-{self.below(10000):04d}"
+
+    def poisson(self, mean: float) -> int:
+        # Knuth's method; means here are small
+        limit, k, p = pow(2.718281828459045, -mean), 0, 1.0
+        while True:
+            p *= self.random()
+            if p <= limit:
+                return k
+            k += 1
+
+    def user(self, n: int) -> dict:
+        name = self.person()
+        return {
+            "id": self.uuid(),
+            "name": name,
+            "email": f"{name.lower().replace(' ', '.')}.{n}@example.com",
+            "role": self.choice(ROLE_WEIGHTS),
+            "phone": self.phone(),
+            "created_at": self.past(5 * 365),
+        }
+
+    def client(self, n: int) -> dict:
+        if self.random() < 0.3:
+            name = f"{self.pick(LAST_NAMES)} {self.pick(COMPANIES)}"
+        else:
+            name = self.person()
+        return {
+            "id": self.uuid(),
+            "name": name,
+            "email": f"client{n}@example.com",
+            "phone": self.phone(),
+            "address": f"{1 + self.below(9998)} {self.pick(STREETS)}",
+            "created_at": self.past(5 * 365),
+        }
+
+    def case(self, n: int, client_ids: List[str], attorney_ids: List[str]) -> dict:
+        case_type = CaseType(self.choice(CASE_TYPE_WEIGHTS))
+        created_at = self.past(5 * 365)
+        prefix = "CV" if case_type == CaseType.CIVIL else "CR"
+        return {
+            "id": self.uuid(),
+            "case_number": f"{prefix}-{created_at.year}-{n:07d}",
+            "title": f"{self.pick(LAST_NAMES)} v. {self.pick(LAST_NAMES)}",
+            "case_type": case_type.value,
+            "status": self.choice(STATUS_WEIGHTS),
+            "client_id": self.pick(client_ids),
+            "assigned_attorney": self.pick(attorney_ids),
+            "court_name": self.pick(COURTS),
+            "judge_name": self.pick(JUDGES),
+            "description": None,
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(seconds=self.below(180 * 86400)),
+        }
+
+    def court_dates(self, case: dict) -> Iterator[dict]:
+        status = CaseStatus(case["status"])
+        for _ in range(self.poisson(HEARING_DENSITY[status])):
+            if status in (CaseStatus.ACTIVE, CaseStatus.PENDING) and self.random() < 0.6:
+                when = self.anchor + timedelta(seconds=self.below(120 * 86400))
+            else:
+                when = case["created_at"] + timedelta(seconds=self.below(365 * 86400))
+            # Hearings are scheduled on the quarter hour during business hours
+            when = when.replace(hour=8 + self.below(9), minute=self.pick((0, 15, 30, 45)),
+                                second=0, microsecond=0)
+            yield {
+                "id": self.uuid(),
+                "case_id": case["id"],
+                "date": when,
+                "court_name": case["court_name"],
+                "judge_name": case["judge_name"],
+                "hearing_type": self.pick(HEARING_TYPES),
+                "notes": None,
+                "priority": self.choice(PRIORITY_WEIGHTS),
+                "created_at": case["created_at"],
+            }
+
+    def document(self, case: dict, uploaded_by: str, max_bytes: int) -> dict:
+        # Log-normal sizes: median ~60 KB with a long tail of large exhibits
+        size = min(int(self.rng.lognormvariate(11.0, 1.3)), max_bytes)
+        start = self.below(len(self.payload) - size + 1) if size < len(self.payload) else 0
+        extension, file_type = self.pick(FILE_TYPES)
+        # Stored the way create_document stores an inline upload
+        return {
+            "id": self.uuid(),
+            "filename": f"{case['case_number']}-{self.below(100000):05d}.{extension}",
+            "category": self.choice(CATEGORY_WEIGHTS),
+            "file_type": file_type,
+            "uploaded_by": uploaded_by,
+            "uploaded_at": case["created_at"] + timedelta(seconds=self.below(365 * 86400)),
+            "case_id": case["id"],
+            "blob_id": None,
+            "sha256": None,
+            **encode_content(file_type, self.payload[start:start + size]),
+        }
+
+
+class BulkWriter:
+    """``stored_only`` and ``model_only`` name fields the stored record adds to or drops from the API model."""
+
+    def __init__(self, collection, model, batch_size: int, pool: ThreadPoolExecutor, max_pending: int,
+                 stored_only: Iterable[str] = (), model_only: Iterable[str] = ()):
+        self.collection = collection
+        self.model = model
+        self.batch_size = batch_size
+        self.pool = pool
+        self.max_pending = max_pending
+        self.stored_only = set(stored_only)
+        self.fields = set(model.model_fields) - set(model_only) | self.stored_only
+        self.batch: List[dict] = []
+        self.pending: Deque[Future] = deque()
+        self.count = 0
+
+    def add(self, doc: dict):
+        self.batch.append(doc)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        # Validate one record per batch against the API model so the generator can't drift
+        if set(self.batch[0]) != self.fields:
+            raise ValueError(f"{self.model.__name__} fields changed: {sorted(self.fields ^ set(self.batch[0]))}")
+        self.model(**{k: v for k, v in self.batch[0].items() if k not in self.stored_only})
+        # Inserts overlap with generation; cap in-flight batches to bound memory
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.pool.submit(
+            self.collection.insert_many, self.batch, ordered=False, bypass_document_validation=True
+        ))
+        self.count += len(self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        while self.pending:
+            self.pending.popleft().result()
+
+
+def timed(label: str, fn: Callable[[], int]) -> int:
+    started = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    typer.echo(f"{label:<12} {count:>10,} records in {elapsed:7.2f}s ({rate:,.0f}/s)")
+    return count
+
+
+@cli.command()
+def seed(
+    users: int = typer.Option(200, help="Number of users"),
+    clients: int = typer.Option(5000, help="Number of clients"),
+    cases: int = typer.Option(20000, help="Number of cases"),
+    documents_per_case: float = typer.Option(3.0, help="Mean documents per case"),
+    max_document_bytes: int = typer.Option(2 * 1024 * 1024, help="Upper bound for a single document"),
+    seed: int = typer.Option(42, help="Random seed; equal seeds produce identical datasets"),
+    anchor: Optional[datetime] = typer.Option(None, help="Reference 'now' for generated dates (default: today 00:00 UTC)"),
+    batch_size: int = typer.Option(5000, help="Documents per insert_many call"),
+    writers: int = typer.Option(4, help="Concurrent insert_many calls per collection"),
+    drop: bool = typer.Option(False, help="Drop the target collections first"),
+    mongo_url: str = typer.Option(..., envvar="MONGO_URL", help="MongoDB connection string"),
+    db_name: str = typer.Option(..., envvar="DB_NAME", help="Target database"),
+):
+    if anchor is None:
+        anchor = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    gen = Generator(seed, anchor)
+    database = MongoClient(mongo_url, maxPoolSize=writers + 1)[db_name]
+    pool = ThreadPoolExecutor(max_workers=writers)
+    if drop:
+        # Archives, the audit log and everything derived would otherwise describe the old dataset
+        for name in ("users", "clients", "cases", "court_dates", "documents", "audit_log",
+                     court_date_view.COURT_DATE_VIEW, *archive.ARCHIVES.values(), *analytics.ROLLUPS):
+            database.drop_collection(name)
+
+    user_ids, attorney_ids, client_ids = [], [], []
+
+    def write_users():
+        writer = BulkWriter(database.users, User, batch_size, pool, writers)
+        for n in range(users):
+            doc = gen.user(n)
+            user_ids.append(doc["id"])
+            if doc["role"] == UserRole.ATTORNEY.value:
+                attorney_ids.append(doc["id"])
+            writer.add(doc)
+        writer.close()
+        return writer.count
+
+    def write_clients():
+        writer = BulkWriter(database.clients, Client, batch_size, pool, writers)
+        for n in range(clients):
+            doc = gen.client(n)
+            client_ids.append(doc["id"])
+            writer.add(doc)
+        writer.close()
+        return writer.count
+
+    timed("users", write_users)
+    timed("clients", write_clients)
+    if not attorney_ids or not client_ids:
+        raise typer.BadParameter("Cases need at least one attorney and one client")
+
+    case_writer = BulkWriter(database.cases, Case, batch_size, pool, writers)
+    court_date_writer = BulkWriter(database.court_dates, CourtDate, batch_size, pool, writers)
+    # Document payloads are large, so flush them in smaller batches
+    document_writer = BulkWriter(database.documents, Document, max(1, batch_size // 50), pool, writers,
+                                 stored_only={"content"}, model_only={"file_data"})
+
+    def write_cases():
+        for n in range(cases):
+            doc = gen.case(n, client_ids, attorney_ids)
+            case_writer.add(doc)
+            for court_date in gen.court_dates(doc):
+                court_date_writer.add(court_date)
+            for _ in range(gen.poisson(documents_per_case)):
+                document_writer.add(gen.document(doc, gen.pick(user_ids), max_document_bytes))
+        for writer in (case_writer, court_date_writer, document_writer):
+            writer.close()
+        return case_writer.count + court_date_writer.count + document_writer.count
+
+    timed("cases+deps", write_cases)
+    typer.echo(f"cases={case_writer.count:,} court_dates={court_date_writer.count:,} "
+               f"documents={document_writer.count:,}")
+    pool.shutdown()
+
+    async def derive(build):
+        # Motor clients belong to the loop they're first used on
+        return await build(AsyncIOMotorClient(mongo_url, uuidRepresentation='standard')[db_name])
+
+    # The court date routes read the view and the analytics routes the rollups, so both have to
+    # match what was just written
+    timed("court view", lambda: asyncio.run(derive(court_date_view.rebuild)))
+    timed("rollups", lambda: sum(asyncio.run(derive(analytics.backfill)).values()))
+
+
+if __name__ == "__main__":
+    cli()
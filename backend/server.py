@@ -1,25 +1,226 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from cache import Cache
+from middleware import CompressionMiddleware, ETagMiddleware
+from audit import ActorMiddleware, AuditLog
+import admission
+from admission import AdmissionMiddleware, Limiter
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout, NetworkTimeout, OperationFailure, WaitQueueTimeoutError
+from reminders import ReminderScheduler
+import archive
+import analytics
+import court_date_view
+import storage
+import compression
+import zipstream
+from blobs import BlobLocks, BlobStore
+from uploads import UploadError, Uploads
+from idempotency import IdempotencyMiddleware
+import tenancy
+from tenancy import TenantMiddleware, TenantRegistry
+import profiling
+from profiling import ProfilingMiddleware
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import base64
+import binascii
+import hmac
 from enum import Enum
+from urllib.parse import quote
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Per-request profiling: send X-Profile: <PROFILE_TOKEN>, or sample a fraction of requests
+# (which also needs PROFILE_TOKEN, to read the samples back)
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_COLLECTION = "profiles"
+
+# Tenant administration and other operator routes: send X-Admin-Token: <ADMIN_TOKEN>; unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000')),
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+    uuidRepresentation='standard',
+    # Only attached when profiling is configured, so commands aren't observed otherwise
+    event_listeners=[profiling.CommandTimer()] if PROFILE_TOKEN or PROFILE_SAMPLE_RATE else [],
+)
+# Each tenant (firm) has its own database on the shared client, picked per request from
+# X-Tenant-ID; requests without the header use DB_NAME as before
+db = tenancy.TenantDatabase(
+    client,
+    os.environ['DB_NAME'],
+    # Store UUID ID fields as BSON binary; run `python storage.py migrate` before enabling
+    wrap=storage.CompactDatabase if os.environ.get('COMPACT_IDS', 'false').lower() == 'true' else None,
+    max_handles=int(os.environ.get('TENANT_MAX_HANDLES', '256')),
+)
+# Finished profiles live in the default database, so any worker can serve them
+profiler = profiling.Profiler(
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000,
+    max_profiles=int(os.environ.get('PROFILE_MAX_STORED', '100')),
+    collection=client[os.environ['DB_NAME']][PROFILE_COLLECTION],
+)
+# Registered tenants and their request quotas live in DB_NAME, outside any tenant's data
+tenants = TenantRegistry(
+    client[os.environ['DB_NAME']].tenants,
+    default_quota={
+        "concurrency": int(os.environ.get('TENANT_DEFAULT_CONCURRENCY', '16')),
+        "rate": float(os.environ.get('TENANT_DEFAULT_RATE', '50')),
+        "burst": int(os.environ.get('TENANT_DEFAULT_BURST', '100')),
+    },
+)
+
+# Indexes created at startup; /api/health/ready reports not-ready until they exist
+INDEXES = {
+    "users": [IndexModel([("id", ASCENDING)], unique=True)],
+    "clients": [IndexModel([("id", ASCENDING)], unique=True)],
+    "cases": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("case_number", ASCENDING)], unique=True),
+    ],
+    "court_dates": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("case_id", ASCENDING), ("date", ASCENDING)]),
+        # Reminder window loads and the dashboard's upcoming count; the calendar reads court_date_view
+        IndexModel([("date", ASCENDING)]),
+    ],
+    "documents": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("case_id", ASCENDING), ("uploaded_at", DESCENDING)]),
+        IndexModel([("blob_id", ASCENDING)], sparse=True),
+    ],
+    "upload_sessions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)]),
+    ],
+    # Locks of dead holders are taken over after minutes; clear out the leftovers eventually
+    "blob_locks": [IndexModel([("locked_at", ASCENDING)], expireAfterSeconds=86400)],
+    court_date_view.COURT_DATE_VIEW: [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("case_id", ASCENDING)]),
+        IndexModel([("date", ASCENDING), ("court_name", ASCENDING), ("judge_name", ASCENDING), ("priority", ASCENDING)]),
+    ],
+    "audit_log": [
+        IndexModel([("entity_id", ASCENDING), ("ts", ASCENDING)]),
+        # Hearing and document entries, for a case's history
+        IndexModel([("case_id", ASCENDING), ("ts", ASCENDING)], partialFilterExpression={"case_id": {"$exists": True}}),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "reminder_outbox": [
+        IndexModel([("status", ASCENDING), ("fire_at", ASCENDING)]),
+    ],
+    **analytics.ROLLUP_INDEXES,
+    **{
+        collection: [
+            IndexModel([("id", ASCENDING)], unique=True),
+            IndexModel([("case_id", ASCENDING)]),
+        ]
+        for collection in archive.ARCHIVES.values()
+    },
+}
+INDEXES["documents_archive"].append(IndexModel([("blob_id", ASCENDING)], sparse=True))
+
+# Superseded indexes still present in older databases; dropped on startup
+DROPPED_INDEXES = {
+    "court_dates": ["date_1_court_name_1_judge_name_1_priority_1"],
+}
+indexes_ready = False
+
+# Read-through cache for dashboard and lookup lists; shared across workers when REDIS_URL is set
+cache = Cache(
+    redis_url=os.environ.get('REDIS_URL'),
+    namespace=os.environ['DB_NAME'],
+    l1_ttl=float(os.environ.get('CACHE_L1_TTL_SECONDS', '5')),
+)
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL_SECONDS', '30'))
+LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL_SECONDS', '300'))
+DASHBOARD_KEYS = ("dashboard:stats", "dashboard:upcoming")
+
+# Before/after diffs of every mutation, batched off the request path
+audit_log = AuditLog(
+    db.audit_log,
+    dead_letter=db.audit_dead_letter,
+    batch_size=int(os.environ.get('AUDIT_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('AUDIT_FLUSH_INTERVAL_SECONDS', '1')),
+)
+
+# Hearing reminders, dispatched to the reminder_outbox collection and optionally a webhook
+REMINDERS_ENABLED = os.environ.get('REMINDERS_ENABLED', 'true').lower() == 'true'
+reminders = ReminderScheduler(
+    db,
+    lead_times=[timedelta(minutes=int(m)) for m in os.environ.get('REMINDER_LEAD_MINUTES', '1440,60').split(',')],
+    horizon=timedelta(days=float(os.environ.get('REMINDER_HORIZON_DAYS', '7'))),
+    webhook_url=os.environ.get('REMINDER_WEBHOOK_URL'),
+    retry_backoff=timedelta(seconds=float(os.environ.get('REMINDER_RETRY_BACKOFF_SECONDS', '60'))),
+    tenants=tenants.ids,
+)
+
+# Large files are uploaded in chunks and kept on disk, addressed by their sha256
+blob_store = BlobStore(os.environ.get('BLOB_DIR', str(ROOT_DIR / 'blobs')))
+blob_locks = BlobLocks(db.blob_locks)
+uploads = Uploads(
+    db.upload_sessions,
+    blob_store,
+    blob_locks,
+    max_chunk_size=int(os.environ.get('UPLOAD_MAX_CHUNK_BYTES', str(64 * 1024 * 1024))),
+    max_size=int(os.environ.get('UPLOAD_MAX_BYTES', str(20 * 1024 ** 3))),
+    session_ttl=timedelta(hours=float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))),
+    tenants=tenants.ids,
+)
+
+# Admission control: concurrency,queue_size,queue_timeout_seconds,deadline_seconds per route class
+ADMISSION_DEFAULTS = {
+    "read": "64,256,2,15",
+    "write": "32,128,5,30",
+    "export": "4,8,10,600",
+    "upload": "8,16,10,600",
+    "download": "16,32,10,3600",
+}
+limiters = {
+    name: Limiter(name, *admission.parse_limits(os.environ.get(f'ADMISSION_{name.upper()}', default)))
+    for name, default in ADMISSION_DEFAULTS.items()
+}
+
+def classify_request(method: str, path: str) -> Optional[str]:
+    if not path.startswith("/api/") or path.startswith(("/api/health", "/api/metrics")):
+        return None
+    if method in ("POST", "PUT") and path.startswith(("/api/documents", "/api/uploads")):
+        return "upload"
+    if path.endswith((".zip", "/content")):
+        return "download"
+    # Bulk updates touch thousands of cases; keep them out of the interactive write class
+    if path.startswith(("/api/analytics", "/api/archive")) or path == "/api/cases/bulk-update":
+        return "export"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+# Cases updated per update_many in a bulk update, and the largest explicit ID list accepted
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '1000'))
+BULK_MAX_IDS = int(os.environ.get('BULK_MAX_IDS', '50000'))
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -93,11 +294,16 @@ class Document(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     filename: str
     category: DocumentCategory
-    file_data: str  # base64 encoded
+    file_data: Optional[str] = None  # base64 encoded; None when stored as a blob
     file_type: str
     uploaded_by: str
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
     case_id: str
+    blob_id: Optional[str] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    codec: Optional[str] = None
+    stored_size: Optional[int] = None
 
 class DocumentCreate(BaseModel):
     filename: str
@@ -107,6 +313,30 @@ class DocumentCreate(BaseModel):
     uploaded_by: str
     case_id: str
 
+class UploadCreate(BaseModel):
+    filename: str
+    category: DocumentCategory
+    file_type: str
+    uploaded_by: str
+    case_id: str
+    size: int = Field(gt=0)
+    sha256: Optional[str] = None
+
+class UploadSession(BaseModel):
+    id: str
+    filename: str
+    category: DocumentCategory
+    file_type: str
+    uploaded_by: str
+    case_id: str
+    size: int
+    sha256: Optional[str] = None
+    offset: int
+    status: str
+    document_id: Optional[str] = None
+    created_at: datetime
+    expires_at: datetime
+
 class CourtDate(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     case_id: str
@@ -118,6 +348,14 @@ class CourtDate(BaseModel):
     priority: Priority = Priority.MEDIUM
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CourtDateView(CourtDate):
+    case_title: Optional[str] = None
+    case_number: Optional[str] = None
+    client_id: Optional[str] = None
+    client_name: Optional[str] = None
+    assigned_attorney: Optional[str] = None
+    attorney_name: Optional[str] = None
+
 class CourtDateCreate(BaseModel):
     case_id: str
     date: datetime
@@ -160,18 +398,66 @@ class CaseUpdate(BaseModel):
     judge_name: Optional[str] = None
     description: Optional[str] = None
 
+class CaseFilter(BaseModel):
+    ids: Optional[List[str]] = Field(None, max_length=BULK_MAX_IDS)
+    assigned_attorney: Optional[str] = None
+    status: Optional[CaseStatus] = None
+    client_id: Optional[str] = None
+
+class CaseBulkUpdate(BaseModel):
+    filter: CaseFilter
+    update: CaseUpdate
+
+class CaseBulkResult(BaseModel):
+    matched: int
+    modified: int
+
+class AuditChange(BaseModel):
+    before: Optional[Any] = None
+    after: Optional[Any] = None
+
+class AuditEntry(BaseModel):
+    id: str
+    entity: str
+    entity_id: str
+    action: str
+    actor: Optional[str] = None
+    ts: datetime
+    changes: Dict[str, AuditChange] = {}
+    case_id: Optional[str] = None
+
+class TenantQuota(BaseModel):
+    concurrency: Optional[int] = Field(None, gt=0)
+    rate: Optional[float] = Field(None, gt=0)
+    burst: Optional[int] = Field(None, gt=0)
+
+class TenantCreate(BaseModel):
+    id: str = Field(pattern=tenancy.TENANT_ID_RE.pattern)
+    name: str
+    quota: TenantQuota = TenantQuota()
+
+class Tenant(BaseModel):
+    id: str
+    name: str
+    quota: TenantQuota = TenantQuota()
+    created_at: Optional[datetime] = None
+
 # User routes
 @api_router.post("/users", response_model=User)
 async def create_user(user: UserCreate):
     user_dict = user.dict()
     user_obj = User(**user_dict)
     await db.users.insert_one(user_obj.dict())
+    audit_log.record("user", user_obj.id, "create", after=user_obj.dict())
+    await cache.invalidate("users")
     return user_obj
 
 @api_router.get("/users", response_model=List[User])
 async def get_users():
-    users = await db.users.find().to_list(1000)
-    return [User(**user) for user in users]
+    async def load():
+        users = await db.users.find({}, {"_id": 0}).to_list(1000)
+        return [User(**user) for user in users]
+    return await cache.get_or_load("users", load, ttl=LOOKUP_CACHE_TTL)
 
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str):
@@ -186,12 +472,16 @@ async def create_client(client: ClientCreate):
     client_dict = client.dict()
     client_obj = Client(**client_dict)
     await db.clients.insert_one(client_obj.dict())
+    audit_log.record("client", client_obj.id, "create", after=client_obj.dict())
+    await cache.invalidate("clients", "dashboard:stats")
     return client_obj
 
 @api_router.get("/clients", response_model=List[Client])
 async def get_clients():
-    clients = await db.clients.find().to_list(1000)
-    return [Client(**client) for client in clients]
+    async def load():
+        clients = await db.clients.find({}, {"_id": 0}).to_list(1000)
+        return [Client(**client) for client in clients]
+    return await cache.get_or_load("clients", load, ttl=LOOKUP_CACHE_TTL)
 
 @api_router.get("/clients/{client_id}", response_model=Client)
 async def get_client(client_id: str):
@@ -215,7 +505,13 @@ async def create_case(case: CaseCreate):
     
     case_dict = case.dict()
     case_obj = Case(**case_dict)
-    await db.cases.insert_one(case_obj.dict())
+    try:
+        await db.cases.insert_one(case_obj.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"Case number {case_obj.case_number} already exists")
+    await analytics.apply_case_changes(db, [(None, case_obj.dict())])
+    audit_log.record("case", case_obj.id, "create", after=case_obj.dict())
+    await cache.invalidate(*DASHBOARD_KEYS)
     return case_obj
 
 @api_router.get("/cases", response_model=List[Case])
@@ -226,10 +522,47 @@ async def get_cases():
 @api_router.get("/cases/{case_id}", response_model=Case)
 async def get_case(case_id: str):
     case = await db.cases.find_one({"id": case_id})
+    if not case:
+        # Inactive cases live in the archive; reads fall through to it transparently
+        case = await archive.find_archived_case(db, case_id)
     if not case:
         raise HTTPException(status_code=404, detail="Case not found")
     return Case(**case)
 
+@api_router.post("/cases/{case_id}/restore", response_model=Case)
+async def restore_case(case_id: str):
+    archived = await archive.find_archived_case(db, case_id)
+    if not archived:
+        raise HTTPException(status_code=404, detail="Archived case not found")
+    # Check before restoring, so a clash doesn't leave the children restored without the case
+    if await db.cases.find_one({"case_number": archived["case_number"]}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail=f"Case number {archived['case_number']} is in use")
+    case = await archive.restore_case(db, case_id)
+    if not case:
+        raise HTTPException(status_code=404, detail="Archived case not found")
+    audit_log.record("case", case_id, "restore", after={"updated_at": case["updated_at"]})
+    await court_date_view.add_case(db, case)
+    await cache.invalidate(*DASHBOARD_KEYS)
+    return Case(**case)
+
+async def archive_inactive_cases(older_than: timedelta, compress: bool = True, limit: Optional[int] = None) -> dict:
+    """Archive the current tenant's idle cases, with the audit, reminder, view and cache upkeep
+    of any other case mutation. Shared by the route and the archive CLI."""
+    async def on_archived(case, counts):
+        reminders.cancel_case(case["id"])
+        await court_date_view.remove_case(db, case["id"])
+        audit_log.record("case", case["id"], "archive", before={"status": case["status"]}, cascade=counts)
+
+    totals = await archive.archive_inactive_cases(db, older_than, compress, limit, on_archived=on_archived)
+    await cache.invalidate(*DASHBOARD_KEYS)
+    return totals
+
+# Archives the calling tenant; admin only, like the tenant routes
+@api_router.post("/archive/run")
+async def run_archive(request: Request, older_than_days: int = 365, compress: bool = True, limit: Optional[int] = None):
+    require_admin(request)
+    return await archive_inactive_cases(timedelta(days=older_than_days), compress, limit)
+
 @api_router.put("/cases/{case_id}", response_model=Case)
 async def update_case(case_id: str, case_update: CaseUpdate):
     case = await db.cases.find_one({"id": case_id})
@@ -241,17 +574,92 @@ async def update_case(case_id: str, case_update: CaseUpdate):
     
     await db.cases.update_one({"id": case_id}, {"$set": update_data})
     updated_case = await db.cases.find_one({"id": case_id})
+    audit_log.record("case", case_id, "update", before=case, after=updated_case)
+    await analytics.apply_case_changes(db, [(case, updated_case)])
+    await court_date_view.update_cases(db, [case_id], update_data)
+    await cache.invalidate(*DASHBOARD_KEYS)
     return Case(**updated_case)
 
+@api_router.post("/cases/bulk-update", response_model=CaseBulkResult)
+async def bulk_update_cases(request: CaseBulkUpdate):
+    query = {k: v for k, v in request.filter.dict().items() if v is not None and k != "ids"}
+    if request.filter.ids is not None:
+        query["id"] = {"$in": request.filter.ids}
+    if not query:
+        raise HTTPException(status_code=422, detail="At least one filter field is required")
+    patch = {k: v for k, v in request.update.dict().items() if v is not None}
+    if not patch:
+        raise HTTPException(status_code=422, detail="The update sets no fields")
+
+    # Only the fields needed for audit diffs and the rollups are read back
+    projection = {"_id": 0, "id": 1, "assigned_attorney": 1, "status": 1, "updated_at": 1, **{k: 1 for k in patch}}
+    # Cases that already have every patched value are matched but left untouched
+    differs = {"$or": [{k: {"$ne": v}} for k, v in patch.items()]}
+    matched = modified = 0
+
+    async def apply(chunk: List[dict]):
+        nonlocal modified
+        now = datetime.utcnow()
+        ids = [case["id"] for case in chunk]
+        result = await db.cases.update_many(
+            {"$and": [query, differs, {"id": {"$in": ids}}]},
+            {"$set": {**patch, "updated_at": now}},
+        )
+        modified += result.modified_count
+        if result.modified_count < len(chunk):
+            # Some cases changed since they were read; only record the ones this update wrote
+            written = {case["id"] async for case in db.cases.find({"id": {"$in": ids}, "updated_at": now}, {"id": 1})}
+            chunk = [case for case in chunk if case["id"] in written]
+        changes = [(case, {**case, **patch, "updated_at": now}) for case in chunk]
+        for before, after in changes:
+            audit_log.record("case", before["id"], "update", before=before, after=after, bulk=True)
+        await analytics.apply_case_changes(db, changes)
+        await court_date_view.update_cases(db, [case["id"] for case in chunk], patch)
+
+    chunk = []
+    async for case in db.cases.find(query, projection).batch_size(BULK_CHUNK_SIZE):
+        matched += 1
+        if all(case.get(k) == v for k, v in patch.items()):
+            continue
+        chunk.append(case)
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await apply(chunk)
+            chunk = []
+    if chunk:
+        await apply(chunk)
+    if modified:
+        await cache.invalidate(*DASHBOARD_KEYS)
+    return CaseBulkResult(matched=matched, modified=modified)
+
+@api_router.get("/cases/{case_id}/history", response_model=List[AuditEntry])
+async def get_case_history(case_id: str, limit: int = 500):
+    entries = await db.audit_log.find(
+        {"$or": [{"entity_id": case_id}, {"case_id": case_id}]}, {"_id": 0}
+    ).sort("ts", 1).to_list(limit)
+    # Include changes still waiting in the write buffer
+    flushed = {entry["id"] for entry in entries}
+    entries += [entry for entry in audit_log.pending(case_id) if entry["id"] not in flushed]
+    return [AuditEntry(**entry) for entry in entries[:limit]]
+
 @api_router.delete("/cases/{case_id}")
 async def delete_case(case_id: str):
-    result = await db.cases.delete_one({"id": case_id})
-    if result.deleted_count == 0:
+    case = await db.cases.find_one_and_delete({"id": case_id})
+    if not case:
         raise HTTPException(status_code=404, detail="Case not found")
     
     # Also delete related court dates and documents
-    await db.court_dates.delete_many({"case_id": case_id})
-    await db.documents.delete_many({"case_id": case_id})
+    hearings = await db.court_dates.find({"case_id": case_id}, {"_id": 0, "date": 1, "court_name": 1}).to_list(None)
+    court_dates = await db.court_dates.delete_many({"case_id": case_id})
+    await court_date_view.remove_case(db, case_id)
+    reminders.cancel_case(case_id)
+    blob_ids = await db.documents.distinct("blob_id", {"case_id": case_id, "blob_id": {"$ne": None}})
+    documents = await db.documents.delete_many({"case_id": case_id})
+    await release_blobs(blob_ids)
+    audit_log.record("case", case_id, "delete", before=case,
+                     cascade={"court_dates": court_dates.deleted_count, "documents": documents.deleted_count})
+    await analytics.apply_case_changes(db, [(case, None)])
+    await analytics.apply_hearing_changes(db, hearings, -1)
+    await cache.invalidate(*DASHBOARD_KEYS)
     
     return {"message": "Case deleted successfully"}
 
@@ -266,12 +674,70 @@ async def create_court_date(court_date: CourtDateCreate):
     court_date_dict = court_date.dict()
     court_date_obj = CourtDate(**court_date_dict)
     await db.court_dates.insert_one(court_date_obj.dict())
+    await court_date_view.add_court_dates(db, case, [court_date_obj.dict()])
+    reminders.schedule(court_date_obj.dict())
+    await analytics.apply_hearing_changes(db, [court_date_obj.dict()], 1)
+    audit_log.record("court_date", court_date_obj.id, "create", after=court_date_obj.dict(),
+                     case_id=court_date_obj.case_id)
+    await cache.invalidate(*DASHBOARD_KEYS)
     return court_date_obj
 
-@api_router.get("/court-dates", response_model=List[CourtDate])
-async def get_court_dates():
-    court_dates = await db.court_dates.find().sort("date", 1).to_list(1000)
-    return [CourtDate(**court_date) for court_date in court_dates]
+def court_date_filter(start: Optional[datetime], end: Optional[datetime], court: Optional[str],
+                      judge: Optional[str], priority: Optional[Priority]) -> dict:
+    query = {}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lt"] = end
+    if court:
+        query["court_name"] = court
+    if judge:
+        query["judge_name"] = judge
+    if priority:
+        query["priority"] = priority.value
+    return query
+
+@api_router.get("/court-dates", response_model=List[CourtDateView])
+async def get_court_dates(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    court: Optional[str] = None,
+    judge: Optional[str] = None,
+    priority: Optional[Priority] = None,
+    limit: int = Query(1000, ge=1, le=5000),
+):
+    query = court_date_filter(start, end, court, judge, priority)
+    cursor = db[court_date_view.COURT_DATE_VIEW].find(query, court_date_view.PROJECTION)
+    court_dates = await cursor.sort("date", 1).to_list(limit)
+    return [CourtDateView(**court_date) for court_date in court_dates]
+
+@api_router.get("/court-dates/calendar")
+async def get_court_date_calendar(
+    month: str = Query(..., pattern=r"^\d{4}-\d{2}$"),
+    court: Optional[str] = None,
+    judge: Optional[str] = None,
+    priority: Optional[Priority] = None,
+):
+    try:
+        start = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=422, detail="month must be YYYY-MM")
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    pipeline = [
+        {"$match": court_date_filter(start, end, court, judge, priority)},
+        {"$group": {"_id": {"day": {"$dayOfMonth": "$date"}, "priority": "$priority"}, "count": {"$sum": 1}}},
+        {"$group": {
+            "_id": "$_id.day",
+            "total": {"$sum": "$count"},
+            "by_priority": {"$push": {"k": "$_id.priority", "v": "$count"}},
+        }},
+        {"$project": {"_id": 0, "day": "$_id", "total": 1, "by_priority": {"$arrayToObject": "$by_priority"}}},
+        {"$sort": {"day": 1}},
+    ]
+    days = await db[court_date_view.COURT_DATE_VIEW].aggregate(pipeline).to_list(None)
+    return {"month": month, "total": sum(day["total"] for day in days), "days": days}
 
 @api_router.get("/court-dates/case/{case_id}", response_model=List[CourtDate])
 async def get_court_dates_by_case(case_id: str):
@@ -280,9 +746,14 @@ async def get_court_dates_by_case(case_id: str):
 
 @api_router.delete("/court-dates/{court_date_id}")
 async def delete_court_date(court_date_id: str):
-    result = await db.court_dates.delete_one({"id": court_date_id})
-    if result.deleted_count == 0:
+    court_date = await db.court_dates.find_one_and_delete({"id": court_date_id})
+    if not court_date:
         raise HTTPException(status_code=404, detail="Court date not found")
+    await court_date_view.remove_court_date(db, court_date_id)
+    reminders.cancel(court_date_id)
+    await analytics.apply_hearing_changes(db, [court_date], -1)
+    audit_log.record("court_date", court_date_id, "delete", before=court_date, case_id=court_date["case_id"])
+    await cache.invalidate(*DASHBOARD_KEYS)
     return {"message": "Court date deleted successfully"}
 
 # Document routes
@@ -293,62 +764,318 @@ async def create_document(document: DocumentCreate):
     if not case:
         raise HTTPException(status_code=404, detail="Case not found")
     
-    document_dict = document.dict()
-    document_obj = Document(**document_dict)
-    await db.documents.insert_one(document_obj.dict())
+    try:
+        data = base64.b64decode(document.file_data)
+    except binascii.Error:
+        raise HTTPException(status_code=422, detail="file_data must be base64 encoded")
+    # Stored as (compressed) bytes in "content"; file_data is rebuilt when documents are listed
+    stored = await asyncio.to_thread(compression.encode_content, document.file_type, data)
+    document_obj = Document(**document.dict(), **{k: v for k, v in stored.items() if k != "content"})
+    await db.documents.insert_one({**document_obj.dict(exclude={"file_data"}), "content": stored["content"]})
+    audit_log.record("document", document_obj.id, "create", after=document_obj.dict(),
+                     case_id=document_obj.case_id)
     return document_obj
 
 @api_router.get("/documents/case/{case_id}", response_model=List[Document])
 async def get_documents_by_case(case_id: str):
     documents = await db.documents.find({"case_id": case_id}).sort("uploaded_at", -1).to_list(1000)
-    return [Document(**document) for document in documents]
+    return [Document(**document) for document in await asyncio.to_thread(inline_file_data, documents)]
+
+def inline_file_data(documents: List[dict]) -> List[dict]:
+    for document in documents:
+        if "content" in document:
+            document["file_data"] = base64.b64encode(compression.decode_content(document)).decode()
+            del document["content"]
+    return documents
 
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
-    result = await db.documents.delete_one({"id": document_id})
-    if result.deleted_count == 0:
+    document = await db.documents.find_one_and_delete({"id": document_id}, projection={"file_data": 0, "content": 0})
+    if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    if document.get("blob_id"):
+        await release_blobs([document["blob_id"]])
+    audit_log.record("document", document_id, "delete", before=document, case_id=document["case_id"])
     return {"message": "Document deleted successfully"}
 
+@api_router.get("/documents/{document_id}/content")
+async def get_document_content(document_id: str):
+    document = await db.documents.find_one({"id": document_id}, {"_id": 0})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{quote(document['filename'])}"}
+    if document.get("blob_id"):
+        path, codec = blob_store.locate(document["blob_id"])
+        if path is None:
+            raise HTTPException(status_code=404, detail="Document content missing")
+        if document.get("size") is not None:
+            headers["Content-Length"] = str(document["size"])
+        return StreamingResponse(compression.iter_file(path, codec), media_type=document["file_type"], headers=headers)
+    if "content" in document:
+        data = await asyncio.to_thread(compression.decode_content, document)
+    else:
+        data = base64.b64decode(document["file_data"])
+    return Response(data, media_type=document["file_type"], headers=headers)
+
+@api_router.get("/cases/{case_id}/documents.zip")
+async def download_case_documents(case_id: str, category: Optional[DocumentCategory] = None):
+    case = await db.cases.find_one({"id": case_id}, {"_id": 0, "case_number": 1})
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    query = {"case_id": case_id}
+    if category:
+        query["category"] = category
+    # Metadata only; content is read one document at a time while streaming
+    documents = await db.documents.find(query, {"_id": 0, "content": 0, "file_data": 0}).sort("uploaded_at", 1).to_list(None)
+
+    async def chunks(document):
+        if document.get("blob_id"):
+            path, codec = blob_store.locate(document["blob_id"])
+            if path is None:
+                logger.warning(f"Blob {document['blob_id']} missing from {case_id}/documents.zip")
+                return
+            reader = compression.iter_file(path, codec)
+            while True:
+                chunk = await asyncio.to_thread(next, reader, None)
+                if chunk is None:
+                    return
+                yield chunk
+        stored = await db.documents.find_one({"id": document["id"]}, {"_id": 0, "content": 1, "file_data": 1, "codec": 1})
+        if not stored:
+            return
+        if "content" in stored:
+            yield await asyncio.to_thread(compression.decode_content, stored)
+        elif stored.get("file_data"):
+            yield base64.b64decode(stored["file_data"])
+
+    async def entries():
+        seen = set()
+        for document in documents:
+            filename = document["filename"].replace("/", "_").replace("\\", "_")
+            name = zipstream.unique_name(f"{DocumentCategory(document['category']).value}/{filename}", seen)
+            # Content that zstd shrank is worth deflating; media and archives aren't
+            yield name, document["uploaded_at"], document.get("codec") == compression.ZSTD, chunks(document)
+
+    filename = f"{case['case_number'].replace('/', '-')}-documents.zip"
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+    return StreamingResponse(zipstream.stream_zip(entries()), media_type="application/zip", headers=headers)
+
+async def release_blobs(blob_ids: List[str]):
+    # Blobs are shared by identical files, so only delete ones nothing else points at. The lock
+    # keeps an upload of the same content from referencing the blob between check and delete;
+    # if one holds it, the blob is in use and stays
+    for blob_id in blob_ids:
+        owner = await blob_locks.acquire(blob_id)
+        if owner is None:
+            continue
+        try:
+            if await db.documents.find_one({"blob_id": blob_id}, {"_id": 1}):
+                continue
+            if await db.documents_archive.find_one({"blob_id": blob_id}, {"_id": 1}):
+                continue
+            await asyncio.to_thread(blob_store.delete, blob_id)
+        finally:
+            await blob_locks.release(blob_id, owner)
+
+# Resumable upload routes: create a session, PUT chunks at ?offset=, then POST .../complete
+@api_router.post("/uploads", response_model=UploadSession)
+async def create_upload(upload: UploadCreate):
+    case = await db.cases.find_one({"id": upload.case_id}, {"_id": 1})
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return await uploads.create(upload.dict())
+
+@api_router.get("/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(upload_id: str):
+    return await uploads.get(upload_id)
+
+@api_router.put("/uploads/{upload_id}", response_model=UploadSession)
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    return await uploads.write(upload_id, offset, request.stream(), request.headers.get("x-chunk-sha256"))
+
+@api_router.post("/uploads/{upload_id}/complete", response_model=Document)
+async def complete_upload(upload_id: str):
+    async def create(session):
+        # The document takes the upload's id, so a finalize retried after a crash can't duplicate it
+        document_obj = Document(
+            id=session["id"],
+            filename=session["filename"],
+            category=session["category"],
+            file_type=session["file_type"],
+            uploaded_by=session["uploaded_by"],
+            case_id=session["case_id"],
+            blob_id=session["blob_id"],
+            size=session["size"],
+            sha256=session["blob_id"],
+            codec=session["codec"],
+            stored_size=session["stored_size"],
+        )
+        try:
+            await db.documents.insert_one(document_obj.dict())
+        except DuplicateKeyError:
+            return document_obj.dict()
+        audit_log.record("document", document_obj.id, "create", after=document_obj.dict(),
+                         case_id=document_obj.case_id)
+        return document_obj.dict()
+
+    session = await uploads.finalize(upload_id, create)
+    document = await db.documents.find_one({"id": session["document_id"]}, {"_id": 0})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return Document(**document)
+
+@api_router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    await uploads.abort(upload_id)
+    return {"message": "Upload cancelled"}
+
+# Token-gated responses, so no shared cache may keep them
+PRIVATE = {"Cache-Control": "private, no-store"}
+
+def require_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Requires the X-Admin-Token credential")
+
+# Tenant routes; admin only, and routed to the default tenant's registry
+def require_default_tenant():
+    if tenancy.current_tenant.get() != tenancy.DEFAULT_TENANT:
+        raise HTTPException(status_code=403, detail="Tenants are managed from the default tenant")
+
+@api_router.post("/tenants", response_model=Tenant)
+async def create_tenant(tenant: TenantCreate, request: Request):
+    require_admin(request)
+    require_default_tenant()
+    if tenant.id == tenancy.DEFAULT_TENANT:
+        raise HTTPException(status_code=409, detail="Tenant already exists")
+    try:
+        created = await tenants.create(tenant.id, tenant.name, tenant.quota.dict(exclude_none=True))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Tenant already exists")
+    with tenancy.use_tenant(tenant.id):
+        await create_tenant_indexes()
+    return Tenant(**created)
+
+@api_router.get("/tenants", response_model=List[Tenant])
+async def get_tenants(request: Request, response: Response):
+    require_admin(request)
+    require_default_tenant()
+    response.headers.update(PRIVATE)
+    return [Tenant(**tenant) for tenant in await tenants.list()]
+
+# Health routes
+@api_router.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "mongo": str(e)})
+    if not indexes_ready:
+        return JSONResponse(status_code=503, content={"status": "starting", "indexes": False})
+    return {"status": "ok", "mongo": True, "indexes": True}
+
+@api_router.get("/metrics/admission")
+async def get_admission_metrics():
+    return admission.snapshot(limiters)
+
+@api_router.get("/metrics/tenants")
+async def get_tenant_metrics(request: Request, response: Response):
+    require_admin(request)
+    require_default_tenant()
+    response.headers.update(PRIVATE)
+    return tenants.snapshot()
+
+# Profiles of requests sent with X-Profile, newest first; the same header is required to read them
+def require_profile_token(request: Request):
+    if not PROFILE_TOKEN or not profiling.matches_token(request.headers.get("x-profile"), PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="Profiling requires the X-Profile token")
+
+@api_router.get("/debug/profiles")
+async def get_profiles(request: Request, response: Response):
+    require_profile_token(request)
+    response.headers.update(PRIVATE)
+    return await profiler.list()
+
+@api_router.get("/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, response: Response,
+                      format: str = Query("json", pattern="^(json|folded)$")):
+    require_profile_token(request)
+    profile = await profiler.get(profile_id, folded=format == "folded")
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found", headers=PRIVATE)
+    if format == "folded":
+        return Response(profile, media_type="text/plain", headers=PRIVATE)
+    response.headers.update(PRIVATE)
+    return profile
+
 # Dashboard/Analytics routes
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats():
-    total_cases = await db.cases.count_documents({})
-    active_cases = await db.cases.count_documents({"status": "active"})
-    upcoming_dates = await db.court_dates.count_documents({"date": {"$gte": datetime.utcnow()}})
-    total_clients = await db.clients.count_documents({})
-    
-    return {
-        "total_cases": total_cases,
-        "active_cases": active_cases,
-        "upcoming_court_dates": upcoming_dates,
-        "total_clients": total_clients
-    }
+    async def load():
+        total_cases = await db.cases.count_documents({}) + await db.cases_archive.count_documents({})
+        active_cases = await db.cases.count_documents({"status": "active"})
+        upcoming_dates = await db.court_dates.count_documents({"date": {"$gte": datetime.utcnow()}})
+        total_clients = await db.clients.count_documents({})
+        
+        return {
+            "total_cases": total_cases,
+            "active_cases": active_cases,
+            "upcoming_court_dates": upcoming_dates,
+            "total_clients": total_clients
+        }
+    return await cache.get_or_load("dashboard:stats", load, ttl=DASHBOARD_CACHE_TTL)
 
 @api_router.get("/dashboard/upcoming-dates")
 async def get_upcoming_court_dates():
-    # Get court dates for the next 30 days
-    from datetime import timedelta
-    end_date = datetime.utcnow() + timedelta(days=30)
-    
-    court_dates = await db.court_dates.find({
-        "date": {"$gte": datetime.utcnow(), "$lte": end_date}
-    }).sort("date", 1).to_list(50)
-    
-    # Populate with case information
-    enriched_dates = []
-    for court_date in court_dates:
-        case = await db.cases.find_one({"id": court_date["case_id"]})
-        if case:
-            court_date["case_title"] = case["title"]
-            court_date["case_number"] = case["case_number"]
-        enriched_dates.append(court_date)
-    
-    return enriched_dates
+    async def load():
+        # Get court dates for the next 30 days
+        end_date = datetime.utcnow() + timedelta(days=30)
+        
+        return await db[court_date_view.COURT_DATE_VIEW].find({
+            "date": {"$gte": datetime.utcnow(), "$lte": end_date}
+        }, court_date_view.PROJECTION).sort("date", 1).to_list(50)
+    return await cache.get_or_load("dashboard:upcoming", load, ttl=DASHBOARD_CACHE_TTL)
+
+@api_router.get("/analytics/caseload")
+async def get_caseload(as_of: Optional[date] = None, status: Optional[str] = None):
+    # Per-attorney caseload, today from the running totals or on a past date from the daily deltas
+    as_of_dt = datetime.combine(as_of, datetime.min.time()) if as_of else None
+    statuses = status.split(",") if status else None
+    return await analytics.caseload(db, as_of_dt, statuses)
+
+@api_router.get("/analytics/status-transitions")
+async def get_status_transitions(start: date, end: date):
+    return await analytics.status_transitions(
+        db, datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+    )
+
+@api_router.get("/analytics/hearings-per-court")
+async def get_hearings_per_court(start: date, end: date, court: Optional[str] = None):
+    return await analytics.hearings_per_court(
+        db, datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time()), court
+    )
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Shed load before any work is done; CORS wraps it so 503s stay readable by the browser
+# Inside admission control, which runs each request in its own task
+app.add_middleware(ProfilingMiddleware, profiler=profiler, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE)
+app.add_middleware(AdmissionMiddleware, limiters=limiters, classify=classify_request)
+# Outside admission control, so replayed retries don't take a slot
+app.add_middleware(
+    IdempotencyMiddleware,
+    collection=db.idempotency_keys,
+    paths=["/api/cases", "/api/court-dates", "/api/documents", "/api/uploads"],
+    ttl=timedelta(hours=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))),
+)
+# Outermost of the /api guards: sets the tenant everything inside relies on, and turns away a
+# tenant over its quota before it can take shared admission slots
+app.add_middleware(TenantMiddleware, registry=tenants)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -356,6 +1083,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# ETags are computed on the uncompressed body, so compression must wrap them
+app.add_middleware(ActorMiddleware)
+app.add_middleware(ETagMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', '5')),
+)
+
+@app.exception_handler(ExecutionTimeout)
+@app.exception_handler(NetworkTimeout)
+async def mongo_timeout_handler(request, exc):
+    return JSONResponse(status_code=504, content={"detail": "Database operation timed out"})
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request, exc):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
+
+@app.exception_handler(WaitQueueTimeoutError)
+async def mongo_pool_exhausted_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Database busy, retry later"},
+                        headers={"Retry-After": "1"})
 
 # Configure logging
 logging.basicConfig(
@@ -364,6 +1114,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def create_tenant_indexes():
+    for collection, names in DROPPED_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                await db[collection].drop_index(name)
+            except OperationFailure as e:
+                if e.code != 27:  # IndexNotFound; another worker dropped it first
+                    raise
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                # Existing duplicates; serve without the guard rather than never becoming ready
+                logger.error(f"Unique index {index.document['name']} on {collection} not created, "
+                             f"remove the duplicates and restart: {e}")
+
+async def create_indexes():
+    global indexes_ready
+    await tenants.collection.create_indexes([IndexModel([("id", ASCENDING)], unique=True)])
+    if PROFILE_TOKEN or PROFILE_SAMPLE_RATE:
+        await profiling.create_store(client[os.environ['DB_NAME']], PROFILE_COLLECTION, profiler.max_profiles)
+    for tenant in await tenants.ids():
+        with tenancy.use_tenant(tenant):
+            await create_tenant_indexes()
+    indexes_ready = True
+
+@app.on_event("startup")
+async def bootstrap_indexes():
+    # Don't block startup on Mongo; readiness stays false until this succeeds
+    async def run():
+        while True:
+            try:
+                await create_indexes()
+                logger.info("Index bootstrap complete")
+                return
+            except Exception as e:
+                logger.warning(f"Index bootstrap failed, retrying: {e}")
+                await asyncio.sleep(2)
+    app.state.index_bootstrap = asyncio.create_task(run())
+
+@app.on_event("startup")
+async def backfill_court_date_view():
+    # Tenants with court dates but no view yet (e.g. right after upgrading) get it built once
+    async def run():
+        await app.state.index_bootstrap
+        for tenant in await tenants.ids():
+            with tenancy.use_tenant(tenant):
+                try:
+                    if (await db.court_dates.find_one({}, {"_id": 1})
+                            and not await db[court_date_view.COURT_DATE_VIEW].find_one({}, {"_id": 1})):
+                        await court_date_view.rebuild(db)
+                except Exception as e:
+                    logger.warning(f"Court date view backfill failed for tenant {tenant}: {e}")
+    app.state.court_date_view_backfill = asyncio.create_task(run())
+
+@app.on_event("startup")
+async def start_cache():
+    await cache.start()
+
+@app.on_event("startup")
+async def start_audit_log():
+    await audit_log.start()
+
+@app.on_event("startup")
+async def start_uploads():
+    await uploads.start()
+
+@app.on_event("startup")
+async def start_reminders():
+    if REMINDERS_ENABLED:
+        await reminders.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await reminders.close()
+    await uploads.close()
+    await cache.close()
+    await audit_log.close()
     client.close()
@@ -0,0 +1,304 @@
+"""Opt-in compact storage for UUID identifiers.
+
+With ``COMPACT_IDS=true`` the API still speaks string IDs, but every UUID-valued ID field is
+stored as BSON binary subtype 4 (16 bytes instead of a 36-char string plus length prefix),
+which roughly halves the size of the ``id``/``case_id``/... indexes. ``CompactDatabase`` wraps
+a Motor database and converts filters, documents and pipelines on the way in and UUIDs back
+to strings on the way out.
+
+Existing data must be converted with ``python storage.py migrate`` before the flag is turned
+on; a collection holding both representations won't match queries for the old one.
+"""
+import re
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import typer
+from bson import Binary
+from bson.binary import UUID_SUBTYPE
+from dotenv import load_dotenv
+from pymongo import DeleteMany, DeleteOne, InsertOne, MongoClient, ReplaceOne, UpdateMany, UpdateOne
+
+import tenancy
+
+ID_FIELDS = {
+    "id", "client_id", "case_id", "assigned_attorney", "uploaded_by",
+    "entity_id", "court_date_id", "attorney", "actor", "document_id",
+}
+UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _to_uuid(value: Any) -> Any:
+    if isinstance(value, str) and len(value) == 36 and UUID_RE.match(value):
+        return Binary.from_uuid(uuid.UUID(value))
+    if isinstance(value, list):
+        return [_to_uuid(item) for item in value]
+    if isinstance(value, dict):
+        # Query operators on an ID field: {"$in": [...]}, {"$ne": ...}
+        return {k: _to_uuid(v) if k.startswith("$") else encode(v) for k, v in value.items()}
+    return value
+
+
+def encode(value: Any) -> Any:
+    """Convert string UUIDs under ID field names to BSON binary subtype 4."""
+    if isinstance(value, dict):
+        return {k: _to_uuid(v) if k in ID_FIELDS else encode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Binary) and value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    if isinstance(value, dict):
+        return {k: decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def _encode_operation(operation):
+    # pymongo's bulk operation classes keep their arguments in these attributes
+    if isinstance(operation, InsertOne):
+        operation._doc = encode(operation._doc)
+    elif isinstance(operation, (ReplaceOne, UpdateOne, UpdateMany)):
+        operation._filter = encode(operation._filter)
+        operation._doc = encode(operation._doc)
+    elif isinstance(operation, (DeleteOne, DeleteMany)):
+        operation._filter = encode(operation._filter)
+    return operation
+
+
+class CompactCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args):
+        self._cursor = self._cursor.limit(*args)
+        return self
+
+    def skip(self, *args):
+        self._cursor = self._cursor.skip(*args)
+        return self
+
+    def batch_size(self, *args):
+        self._cursor = self._cursor.batch_size(*args)
+        return self
+
+    async def to_list(self, length):
+        return decode(await self._cursor.to_list(length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return decode(await self._cursor.__anext__())
+
+
+class CompactCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, filter=None, *args, **kwargs):
+        return CompactCursor(self._collection.find(encode(filter or {}), *args, **kwargs))
+
+    def aggregate(self, pipeline: List[dict], *args, **kwargs):
+        return CompactCursor(self._collection.aggregate(encode(pipeline), *args, **kwargs))
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return decode(await self._collection.find_one(encode(filter or {}), *args, **kwargs))
+
+    async def find_one_and_delete(self, filter, *args, **kwargs):
+        return decode(await self._collection.find_one_and_delete(encode(filter), *args, **kwargs))
+
+    async def find_one_and_update(self, filter, update, *args, **kwargs):
+        return decode(await self._collection.find_one_and_update(encode(filter), encode(update), *args, **kwargs))
+
+    async def count_documents(self, filter, *args, **kwargs):
+        return await self._collection.count_documents(encode(filter), *args, **kwargs)
+
+    async def distinct(self, key, filter=None, *args, **kwargs):
+        return decode(await self._collection.distinct(key, encode(filter), *args, **kwargs))
+
+    async def insert_one(self, document: Dict, *args, **kwargs):
+        encoded = encode(document)
+        try:
+            return await self._collection.insert_one(encoded, *args, **kwargs)
+        finally:
+            # Mirror pymongo, which sets _id on the caller's document
+            if "_id" in encoded:
+                document["_id"] = encoded["_id"]
+
+    async def insert_many(self, documents: List[Dict], *args, **kwargs):
+        encoded = [encode(document) for document in documents]
+        try:
+            return await self._collection.insert_many(encoded, *args, **kwargs)
+        finally:
+            for document, stored in zip(documents, encoded):
+                if "_id" in stored:
+                    document["_id"] = stored["_id"]
+
+    async def replace_one(self, filter, replacement, *args, **kwargs):
+        return await self._collection.replace_one(encode(filter), encode(replacement), *args, **kwargs)
+
+    async def update_one(self, filter, update, *args, **kwargs):
+        return await self._collection.update_one(encode(filter), encode(update), *args, **kwargs)
+
+    async def update_many(self, filter, update, *args, **kwargs):
+        return await self._collection.update_many(encode(filter), encode(update), *args, **kwargs)
+
+    async def delete_one(self, filter, *args, **kwargs):
+        return await self._collection.delete_one(encode(filter), *args, **kwargs)
+
+    async def delete_many(self, filter, *args, **kwargs):
+        return await self._collection.delete_many(encode(filter), *args, **kwargs)
+
+    async def bulk_write(self, requests, *args, **kwargs):
+        return await self._collection.bulk_write([_encode_operation(r) for r in requests], *args, **kwargs)
+
+
+class CompactDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return CompactCollection(self._database[name])
+
+    def __getitem__(self, name):
+        return CompactCollection(self._database[name])
+
+    async def command(self, *args, **kwargs):
+        return await self._database.command(*args, **kwargs)
+
+
+# Collections rewritten by the migration; rollups key on attorney IDs inside _id, so they're
+# rebuilt with the analytics backfill instead
+MIGRATED_COLLECTIONS = [
+    "users", "clients", "cases", "court_dates", "documents", "audit_log",
+    "cases_archive", "court_dates_archive", "documents_archive",
+    "court_date_view", "upload_sessions",
+]
+
+cli = typer.Typer(help="Migrate ID fields to the compact binary representation.")
+
+
+def human(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def tenant_databases(client, db_name: str, tenant: Optional[str]) -> Iterator[Tuple[str, Any]]:
+    """``(tenant, database)`` for ``tenant``, or for every registered tenant when it's None.
+
+    COMPACT_IDS applies to every tenant's database, so all of them have to be migrated.
+    """
+    if tenant:
+        tenant_ids = [tenant]
+    else:
+        tenant_ids = [tenancy.DEFAULT_TENANT] + [doc["id"] for doc in client[db_name].tenants.find({}, {"_id": 0, "id": 1})]
+    for tenant_id in tenant_ids:
+        yield tenant_id, client[tenancy.database_name(db_name, tenant_id)]
+
+
+def collection_sizes(database, name: str) -> dict:
+    stats = database.command("collStats", name)
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "indexes": stats.get("totalIndexSize", 0),
+        "by_index": stats.get("indexSizes", {}),
+    }
+
+
+def migrate_collection(collection, batch_size: int, dry_run: bool) -> int:
+    query = {"$or": [{field: {"$type": "string"}} for field in ID_FIELDS]}
+    converted = 0
+    batch = []
+    for doc in collection.find(query, {field: 1 for field in ID_FIELDS}):
+        changes = {}
+        for field in ID_FIELDS & doc.keys():
+            value = _to_uuid(doc[field])
+            if value != doc[field]:
+                changes[field] = value
+        if not changes:
+            continue
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(batch, ordered=False)
+            converted += len(batch)
+            batch = []
+    if batch:
+        if not dry_run:
+            collection.bulk_write(batch, ordered=False)
+        converted += len(batch)
+    return converted
+
+
+@cli.command()
+def migrate(
+    batch_size: int = typer.Option(1000, help="Documents per bulk_write"),
+    dry_run: bool = typer.Option(False, help="Count documents to convert without writing"),
+    compact: bool = typer.Option(False, help="Run 'compact' afterwards so freed pages are released"),
+    tenant: Optional[str] = typer.Option(None, help="Tenant to migrate; all registered tenants by default"),
+    mongo_url: str = typer.Option(..., envvar="MONGO_URL"),
+    db_name: str = typer.Option(..., envvar="DB_NAME"),
+):
+    """Rewrite string UUID fields as binary subtype 4 and report sizes before and after."""
+    client = MongoClient(mongo_url)
+    rows = []
+    for tenant_id, database in tenant_databases(client, db_name, tenant):
+        existing = set(database.list_collection_names())
+        for name in MIGRATED_COLLECTIONS:
+            if name not in existing:
+                continue
+            before = collection_sizes(database, name)
+            converted = migrate_collection(database[name], batch_size, dry_run)
+            if compact and not dry_run:
+                database.command("compact", name)
+            after = collection_sizes(database, name)
+            rows.append((tenant_id, name, before, after))
+            typer.echo(f"{tenant_id}/{name}: converted {converted:,} of {before['count']:,} documents")
+
+    typer.echo(f"\n{'collection':<36}{'data before':>14}{'data after':>14}{'index before':>14}{'index after':>14}")
+    for tenant_id, name, before, after in rows:
+        typer.echo(f"{tenant_id + '/' + name:<36}{human(before['size']):>14}{human(after['size']):>14}"
+                   f"{human(before['indexes']):>14}{human(after['indexes']):>14}")
+    typer.echo("\nRebuild the rollups with 'python analytics.py backfill', then set COMPACT_IDS=true.")
+
+
+@cli.command()
+def report(
+    tenant: Optional[str] = typer.Option(None, help="Tenant to report on; all registered tenants by default"),
+    mongo_url: str = typer.Option(..., envvar="MONGO_URL"),
+    db_name: str = typer.Option(..., envvar="DB_NAME"),
+):
+    """Print data and per-index sizes without changing anything."""
+    for tenant_id, database in tenant_databases(MongoClient(mongo_url), db_name, tenant):
+        existing = set(database.list_collection_names())
+        for name in MIGRATED_COLLECTIONS:
+            if name in existing:
+                sizes = collection_sizes(database, name)
+                indexes = ", ".join(f"{index}={human(size)}" for index, size in sizes["by_index"].items())
+                typer.echo(f"{tenant_id}/{name}: {sizes['count']:,} docs, data {human(sizes['size'])}, indexes {indexes}")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    cli()
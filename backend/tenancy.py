@@ -0,0 +1,240 @@
+"""Per-tenant databases behind a single Motor client.
+
+Each request runs with ``current_tenant`` set from its ``X-Tenant-ID`` header (``default``
+when absent), and ``TenantDatabase`` sends every ``db.<collection>`` call to that tenant's
+database. The ``default`` tenant keeps using ``DB_NAME``, so single-firm deployments see no
+change. All tenants share the client's connection pool; only lightweight database handles
+are per tenant, kept in a bounded LRU.
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_TENANT = "default"
+# Tenant ids become part of database names, which Mongo limits to 64 bytes
+TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9-]{0,39}$")
+
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+
+@contextmanager
+def use_tenant(tenant: str):
+    token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+def database_name(base: str, tenant: str) -> str:
+    return base if tenant == DEFAULT_TENANT else f"{base}_t_{tenant}"
+
+
+class TenantCollection:
+    """Looks the collection up in the current tenant's database on every call."""
+
+    def __init__(self, database: "TenantDatabase", name: str):
+        self._database = database
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __getattr__(self, attr):
+        return getattr(self._database.resolve()[self._name], attr)
+
+
+class TenantDatabase:
+    def __init__(self, client, base_name: str, wrap: Optional[Callable] = None, max_handles: int = 256):
+        self._client = client
+        self._base_name = base_name
+        self._wrap = wrap
+        self._max_handles = max_handles
+        self._handles: "OrderedDict[str, object]" = OrderedDict()
+
+    def resolve(self, tenant: Optional[str] = None):
+        tenant = tenant or current_tenant.get()
+        handle = self._handles.get(tenant)
+        if handle is None:
+            handle = self._client[database_name(self._base_name, tenant)]
+            if self._wrap:
+                handle = self._wrap(handle)
+            self._handles[tenant] = handle
+            while len(self._handles) > self._max_handles:
+                self._handles.popitem(last=False)
+        else:
+            self._handles.move_to_end(tenant)
+        return handle
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return TenantCollection(self, name)
+
+    def __getitem__(self, name):
+        return TenantCollection(self, name)
+
+    async def command(self, *args, **kwargs):
+        return await self.resolve().command(*args, **kwargs)
+
+
+class Quota:
+    """Per-tenant concurrency cap plus a token-bucket request rate."""
+
+    def __init__(self, concurrency: int, rate: float, burst: int):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected_concurrency = 0
+        self.rejected_rate = 0
+        self.busy_seconds = 0.0
+
+    def admit(self) -> Optional[str]:
+        """Take a slot, or return why the request has to be rejected."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.in_flight >= self.concurrency:
+            self.rejected_concurrency += 1
+            return "concurrency"
+        if self.tokens < 1:
+            self.rejected_rate += 1
+            return "rate"
+        self.tokens -= 1
+        self.in_flight += 1
+        self.requests += 1
+        return None
+
+    def release(self, elapsed: float):
+        self.in_flight -= 1
+        self.busy_seconds += elapsed
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "burst": self.burst,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "rejected_concurrency": self.rejected_concurrency,
+            "rejected_rate": self.rejected_rate,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class TenantRegistry:
+    """Known tenants and their quotas, read from the ``tenants`` collection of the default database."""
+
+    def __init__(self, collection, default_quota: Dict[str, float], cache_ttl: float = 30.0):
+        self.collection = collection
+        self.default_quota = default_quota
+        self.cache_ttl = cache_ttl
+        self.quotas: Dict[str, Quota] = {}
+        self._tenants: Dict[str, dict] = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._loaded_at < self.cache_ttl:
+            return
+        async with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.cache_ttl:
+                return
+            tenants = {DEFAULT_TENANT: {"id": DEFAULT_TENANT, "name": DEFAULT_TENANT}}
+            async for tenant in self.collection.find({}, {"_id": 0}):
+                tenants[tenant["id"]] = tenant
+            self._tenants = tenants
+            self._loaded_at = time.monotonic()
+            for tenant_id, tenant in tenants.items():
+                self._apply_quota(tenant_id, tenant.get("quota") or {})
+
+    def _apply_quota(self, tenant_id: str, overrides: dict):
+        settings = {**self.default_quota, **overrides}
+        quota = self.quotas.get(tenant_id)
+        if quota is None:
+            self.quotas[tenant_id] = Quota(int(settings["concurrency"]), float(settings["rate"]), int(settings["burst"]))
+        else:
+            quota.concurrency = int(settings["concurrency"])
+            quota.rate = float(settings["rate"])
+            quota.burst = int(settings["burst"])
+
+    async def get(self, tenant_id: str) -> Optional[dict]:
+        await self._refresh()
+        if tenant_id not in self._tenants and time.monotonic() - self._loaded_at > 1:
+            # Possibly created through another worker since the last load
+            await self._refresh(force=True)
+        return self._tenants.get(tenant_id)
+
+    async def ids(self) -> List[str]:
+        await self._refresh()
+        return list(self._tenants)
+
+    async def list(self) -> List[dict]:
+        await self._refresh()
+        return list(self._tenants.values())
+
+    async def create(self, tenant_id: str, name: str, quota: Optional[dict] = None) -> dict:
+        tenant = {"id": tenant_id, "name": name, "quota": quota or {}, "created_at": datetime.utcnow()}
+        await self.collection.insert_one(tenant)
+        tenant.pop("_id", None)
+        await self._refresh(force=True)
+        return tenant
+
+    def snapshot(self) -> dict:
+        return {"ts": time.time(), "tenants": {tenant_id: quota.snapshot() for tenant_id, quota in self.quotas.items()}}
+
+
+class TenantMiddleware:
+    """Resolves the tenant for /api requests and enforces its quota (429 with Retry-After).
+
+    Sits outside admission control, so a noisy tenant is turned away before it can occupy
+    the shared admission slots. Responses carry ``Vary: X-Tenant-ID`` so no shared cache
+    hands one tenant's data to another.
+    """
+
+    def __init__(self, app: ASGIApp, registry: TenantRegistry, exempt: tuple = ("/api/health",)):
+        self.app = app
+        self.registry = registry
+        self.exempt = exempt
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+        tenant_id = Headers(scope=scope).get("x-tenant-id", DEFAULT_TENANT).lower()
+        if not TENANT_ID_RE.match(tenant_id) or await self.registry.get(tenant_id) is None:
+            await JSONResponse({"detail": f"Unknown tenant {tenant_id!r}"}, status_code=404)(scope, receive, send)
+            return
+        quota = self.registry.quotas[tenant_id]
+        rejected = quota.admit()
+        if rejected:
+            retry_after = 1 if rejected == "concurrency" else max(1, int(1 / max(quota.rate, 0.001)))
+            response = JSONResponse({"detail": f"Tenant {rejected} quota exceeded, retry later"},
+                                    status_code=429, headers={"Retry-After": str(retry_after)})
+            await response(scope, receive, send)
+            return
+        async def send_varying(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).add_vary_header("X-Tenant-ID")
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            with use_tenant(tenant_id):
+                await self.app(scope, receive, send_varying)
+        finally:
+            quota.release(time.monotonic() - started)
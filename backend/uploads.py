@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+import compression
+from blobs import READ_SIZE, BlobLocks, BlobStore, sha256_file
+from tenancy import DEFAULT_TENANT, use_tenant
+
+logger = logging.getLogger(__name__)
+
+# How long finalizing waits for a blob deletion that holds the blob's lock
+LOCK_WAIT_TIMEOUT = 10.0
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.headers = headers
+
+
+def _open_at(path, offset: int):
+    # Bytes past the committed offset belong to an interrupted chunk; drop them
+    f = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT, 0o640), "wb")
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+def _sync_close(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+class Uploads:
+    """Resumable uploads: create a session, PUT chunks at increasing offsets, then finalize.
+
+    Chunks stream straight to a partial file in the BlobStore, so memory per upload is bounded
+    by ``READ_SIZE``. A session's offset only advances once its chunk is on disk, and a PUT
+    must claim the session at that offset, so a retried or concurrent chunk can't corrupt the
+    file; a client that loses track asks for the session and resumes from its ``offset``.
+    The running sha256 is kept per upload so finalizing doesn't re-read the file, unless the
+    chunks were spread over workers or a restart, in which case it is rebuilt from disk.
+    Finalizing stores the file zstd-compressed when that pays off, and holds the blob's lock
+    until the document references it, so a concurrent delete can't remove a reused blob.
+    """
+
+    def __init__(self, collection, store: BlobStore, locks: BlobLocks, max_chunk_size: int, max_size: int,
+                 session_ttl: timedelta = timedelta(hours=24), lock_timeout: timedelta = timedelta(minutes=10),
+                 max_hashers: int = 1024, tenants: Optional[Callable[[], Awaitable[List[str]]]] = None):
+        self.collection = collection
+        self.store = store
+        self.locks = locks
+        self.max_chunk_size = max_chunk_size
+        self.max_size = max_size
+        self.session_ttl = session_ttl
+        self.lock_timeout = lock_timeout
+        self.max_hashers = max_hashers
+        self.tenants = tenants
+        # upload id -> (offset, sha256 of the bytes before it)
+        self._hashers: "OrderedDict[str, tuple]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def create(self, fields: dict) -> dict:
+        if fields["size"] > self.max_size:
+            raise UploadError(413, f"Uploads are limited to {self.max_size} bytes")
+        now = datetime.utcnow()
+        session = {
+            **fields,
+            "id": str(uuid.uuid4()),
+            "offset": 0,
+            "status": "open",
+            "document_id": None,
+            "writer": None,
+            "locked_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + self.session_ttl,
+        }
+        await self.collection.insert_one(session)
+        session.pop("_id", None)
+        return session
+
+    async def get(self, upload_id: str) -> dict:
+        session = await self.collection.find_one({"id": upload_id}, {"_id": 0})
+        if not session:
+            raise UploadError(404, "Upload not found")
+        return session
+
+    async def write(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes],
+                    chunk_sha256: Optional[str] = None) -> dict:
+        session, token = await self._claim(upload_id, offset)
+        hasher = self._take_hasher(upload_id, offset)
+        chunk_hasher = hashlib.sha256() if chunk_sha256 else None
+        path = self.store.partial_path(upload_id)
+        written = 0
+        committed = False
+        f = None
+        try:
+            f = await asyncio.to_thread(_open_at, path, offset)
+            buffer = bytearray()
+            async for data in chunks:
+                written += len(data)
+                if written > self.max_chunk_size:
+                    raise UploadError(413, f"Chunks are limited to {self.max_chunk_size} bytes")
+                if offset + written > session["size"]:
+                    raise UploadError(413, f"Chunk runs past the declared size of {session['size']} bytes")
+                buffer += data
+                if len(buffer) >= READ_SIZE:
+                    await self._write(f, buffer, hasher, chunk_hasher)
+                    buffer = bytearray()
+            if buffer:
+                await self._write(f, buffer, hasher, chunk_hasher)
+            await asyncio.to_thread(_sync_close, f)
+            if chunk_hasher and chunk_hasher.hexdigest() != chunk_sha256.lower():
+                raise UploadError(422, "Chunk checksum mismatch", {"Upload-Offset": str(offset)})
+            now = datetime.utcnow()
+            session = await self.collection.find_one_and_update(
+                {"id": upload_id, "writer": token},
+                {"$set": {"offset": offset + written, "writer": None, "locked_at": None,
+                          "updated_at": now, "expires_at": now + self.session_ttl}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            if session is None:
+                raise UploadError(409, "Upload lock expired while writing; resume from the current offset")
+            committed = True
+            if hasher is not None:
+                self._put_hasher(upload_id, offset + written, hasher)
+            return session
+        finally:
+            if f is not None and not f.closed:
+                await asyncio.to_thread(f.close)
+            if not committed:
+                await self._release(upload_id, token)
+
+    async def finalize(self, upload_id: str, on_complete: Callable[[dict], Awaitable[dict]]) -> dict:
+        """Verify and store the upload, then call ``on_complete(session)`` to create its document.
+
+        Finalizing an already finalized upload returns the same document id, so clients can
+        safely retry.
+        """
+        session = await self.get(upload_id)
+        if session["status"] == "complete":
+            return session
+        if session["offset"] != session["size"]:
+            raise UploadError(409, f"Upload incomplete: {session['offset']} of {session['size']} bytes received",
+                              {"Upload-Offset": str(session["offset"])})
+        session, token = await self._claim(upload_id, session["size"])
+        try:
+            blob_id = session.get("blob_id")
+            path, codec = self.store.locate(blob_id) if blob_id else (None, None)
+            if path is None:
+                hasher = self._take_hasher(upload_id, session["size"])
+                if hasher is None:
+                    hasher = await asyncio.to_thread(sha256_file, self.store.partial_path(upload_id))
+                blob_id = hasher.hexdigest()
+                if session.get("sha256") and session["sha256"].lower() != blob_id:
+                    # The bytes on disk are wrong somewhere; start the upload over
+                    await asyncio.to_thread(self.store.discard, upload_id)
+                    await self.collection.update_one({"id": upload_id}, {"$set": {"offset": 0}})
+                    raise UploadError(422, "Upload checksum mismatch; upload again from offset 0",
+                                      {"Upload-Offset": "0"})
+                # Remember the digest first, so a retry after a crash mid-commit can find the blob
+                await self.collection.update_one({"id": upload_id}, {"$set": {"blob_id": blob_id}})
+                codec = await asyncio.to_thread(self._compress, upload_id, blob_id, session["file_type"])
+            # Held until the document references the blob, so it can't be deleted in between
+            owner = await self.locks.wait(blob_id, LOCK_WAIT_TIMEOUT)
+            if owner is None:
+                raise UploadError(503, "The stored file is being cleaned up; retry", {"Retry-After": "1"})
+            try:
+                if path is None:
+                    codec = await asyncio.to_thread(self.store.commit, upload_id, blob_id, codec)
+                    path = self.store.path(blob_id, codec)
+                elif not path.exists():
+                    # Deleted with its last document after this upload was committed
+                    await self.collection.update_one({"id": upload_id}, {"$set": {"offset": 0, "blob_id": None}})
+                    raise UploadError(409, "Upload data is gone; upload again from offset 0", {"Upload-Offset": "0"})
+                session.update(blob_id=blob_id, codec=codec, stored_size=path.stat().st_size)
+                document = await on_complete(session)
+            finally:
+                await self.locks.release(blob_id, owner)
+            session = await self.collection.find_one_and_update(
+                {"id": upload_id, "writer": token},
+                {"$set": {"status": "complete", "document_id": document["id"], "writer": None,
+                          "locked_at": None, "updated_at": datetime.utcnow()}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            token = None
+            return session
+        finally:
+            if token:
+                await self._release(upload_id, token)
+
+    async def abort(self, upload_id: str):
+        session = await self.collection.find_one_and_delete({"id": upload_id, "status": "open"})
+        if not session:
+            raise UploadError(404, "Upload not found")
+        self._hashers.pop(upload_id, None)
+        await asyncio.to_thread(self.store.discard, upload_id)
+
+    async def expire(self) -> int:
+        expired = 0
+        async for session in self.collection.find({"expires_at": {"$lt": datetime.utcnow()}}, {"id": 1, "status": 1}):
+            if session["status"] == "open":
+                await asyncio.to_thread(self.store.discard, session["id"])
+            await self.collection.delete_one({"id": session["id"]})
+            self._hashers.pop(session["id"], None)
+            expired += 1
+        return expired
+
+    def _compress(self, upload_id: str, blob_id: str, file_type: str) -> Optional[str]:
+        if self.store.locate(blob_id)[0] is not None:
+            # Identical content is already stored
+            return None
+        stored = compression.compress_file_if_worthwhile(
+            self.store.partial_path(upload_id), self.store.partial_path(upload_id, compression.ZSTD), file_type)
+        return compression.ZSTD if stored is not None else None
+
+    async def _write(self, f, buffer: bytearray, hasher, chunk_hasher):
+        if hasher is not None:
+            hasher.update(buffer)
+        if chunk_hasher is not None:
+            chunk_hasher.update(buffer)
+        await asyncio.to_thread(f.write, buffer)
+
+    async def _claim(self, upload_id: str, offset: int):
+        token = str(uuid.uuid4())
+        now = datetime.utcnow()
+        session = await self.collection.find_one_and_update(
+            {
+                "id": upload_id,
+                "status": "open",
+                "offset": offset,
+                "$or": [{"writer": None}, {"locked_at": {"$lt": now - self.lock_timeout}}],
+            },
+            {"$set": {"writer": token, "locked_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if session:
+            return session, token
+        current = await self.get(upload_id)
+        if current["status"] != "open":
+            raise UploadError(409, "Upload already finalized")
+        if current["offset"] != offset:
+            raise UploadError(409, f"Offset mismatch: upload is at {current['offset']}",
+                              {"Upload-Offset": str(current["offset"])})
+        raise UploadError(409, "Another request is writing to this upload", {"Retry-After": "1"})
+
+    async def _release(self, upload_id: str, token: str):
+        try:
+            await self.collection.update_one({"id": upload_id, "writer": token},
+                                             {"$set": {"writer": None, "locked_at": None}})
+        except Exception as e:
+            # The lock times out on its own
+            logger.warning(f"Could not release upload {upload_id}: {e}")
+
+    def _take_hasher(self, upload_id: str, offset: int):
+        entry = self._hashers.pop(upload_id, None)
+        if entry and entry[0] == offset:
+            return entry[1]
+        if offset == 0:
+            return hashlib.sha256()
+        return None
+
+    def _put_hasher(self, upload_id: str, offset: int, hasher):
+        self._hashers[upload_id] = (offset, hasher)
+        while len(self._hashers) > self.max_hashers:
+            self._hashers.popitem(last=False)
+
+    async def _run(self):
+        while True:
+            try:
+                for tenant in await self.tenants() if self.tenants else [DEFAULT_TENANT]:
+                    with use_tenant(tenant):
+                        expired = await self.expire()
+                    if expired:
+                        logger.info(f"Expired {expired} upload sessions for tenant {tenant}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Upload expiry failed: {e}")
+            await asyncio.sleep(600)
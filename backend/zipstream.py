@@ -0,0 +1,79 @@
+import asyncio
+import zipfile
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Tuple
+
+FLUSH_SIZE = 1024 * 1024
+
+# (name in the archive, modified time, worth deflating, content chunks)
+Entry = Tuple[str, datetime, bool, AsyncIterable[bytes]]
+
+
+class _Sink:
+    """Write-only stand-in for a file; having ``tell`` but no ``seek`` puts zipfile in streaming
+    mode, where sizes and CRCs follow each entry in a data descriptor."""
+
+    def __init__(self):
+        self._chunks = []
+        self._buffered = 0
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._buffered += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    @property
+    def buffered(self) -> int:
+        return self._buffered
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._buffered = 0
+        return data
+
+
+async def stream_zip(entries: AsyncIterable[Entry], compresslevel: int = 1) -> AsyncIterator[bytes]:
+    """Build a ZIP64 archive on the fly, yielding it in roughly ``FLUSH_SIZE`` pieces.
+
+    Only the current chunk and the central directory (one small record per entry) are held
+    in memory, however large the entries are. Deflating runs off the event loop.
+    """
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w", allowZip64=True)
+    async for name, modified, compress, chunks in entries:
+        info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        # No public setter for the per-entry level before Python 3.13
+        info._compresslevel = compresslevel
+        # Sizes aren't known up front, so always reserve ZIP64 fields
+        with archive.open(info, "w", force_zip64=True) as dest:
+            async for chunk in chunks:
+                await asyncio.to_thread(dest.write, chunk)
+                if sink.buffered >= FLUSH_SIZE:
+                    yield sink.drain()
+        if sink.buffered >= FLUSH_SIZE:
+            yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
+
+def unique_name(name: str, seen: set) -> str:
+    """``report.pdf``, ``report (2).pdf``, ... so entries with the same name don't collide."""
+    stem, dot, suffix = name.rpartition(".")
+    if not dot or not stem:
+        stem, dot, suffix = name, "", ""
+    candidate, n = name, 1
+    while candidate.lower() in seen:
+        n += 1
+        candidate = f"{stem} ({n}){dot}{suffix}"
+    seen.add(candidate.lower())
+    return candidate
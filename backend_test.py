@@ -248,6 +248,11 @@ def test_case_management():
             logger.info(f"Updating case with ID {case_id}")
             print_response(response)
             
+            # Audit history should show the create and the update
+            response = requests.get(f"{BACKEND_URL}/cases/{case_id}/history")
+            logger.info(f"Getting history for case ID {case_id}")
+            print_response(response)
+            
             # Delete case (will test this last)
             case_to_delete = created_cases[-1]["id"]
             logger.info(f"Will delete case with ID {case_to_delete} after testing other features")
@@ -4,18 +4,28 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+echo "Starting FastAPI backend with ${WEB_CONCURRENCY:-$(nproc)} workers"
+# Start Uvicorn workers with proper host binding
+python3 run.py &
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+READY_TIMEOUT=${READY_TIMEOUT:-120}
+elapsed=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/health/ready 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$elapsed" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    elapsed=$((elapsed + 1))
+done
+echo "Backend ready"
 
 # Start Nginx
 nginx -g 'daemon off;' &
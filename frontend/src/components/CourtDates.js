@@ -24,12 +24,32 @@ const CourtDates = ({ currentUser }) => {
 
   useEffect(() => {
     fetchData();
-  }, []);
+  }, [filter]);
+
+  // The server filters by date range, so only the selected dates are transferred
+  const getDateRange = () => {
+    const now = new Date();
+    switch (filter) {
+      case 'upcoming':
+        return { from: now.toISOString() };
+      case 'past':
+        return { to: now.toISOString() };
+      case 'today': {
+        const today = new Date();
+        today.setHours(0, 0, 0, 0);
+        const tomorrow = new Date(today);
+        tomorrow.setDate(tomorrow.getDate() + 1);
+        return { from: today.toISOString(), to: tomorrow.toISOString() };
+      }
+      default:
+        return {};
+    }
+  };
 
   const fetchData = async () => {
     try {
       const [courtDatesResponse, casesResponse] = await Promise.all([
-        axios.get(`${API}/court-dates`),
+        axios.get(`${API}/court-dates`, { params: getDateRange() }),
         axios.get(`${API}/cases`)
       ]);
       
@@ -96,31 +116,10 @@ const CourtDates = ({ currentUser }) => {
     });
   };
 
-  const getCaseInfo = (caseId) => {
-    const caseItem = cases.find(c => c.id === caseId);
-    return caseItem ? `${caseItem.case_number} - ${caseItem.title}` : 'Unknown Case';
+  const getCaseInfo = (courtDate) => {
+    return courtDate.case_number ? `${courtDate.case_number} - ${courtDate.case_title}` : 'Unknown Case';
   };
 
-  const filteredCourtDates = courtDates.filter(courtDate => {
-    const now = new Date();
-    const dateObj = new Date(courtDate.date);
-    
-    switch (filter) {
-      case 'upcoming':
-        return dateObj >= now;
-      case 'past':
-        return dateObj < now;
-      case 'today':
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        const tomorrow = new Date(today);
-        tomorrow.setDate(tomorrow.getDate() + 1);
-        return dateObj >= today && dateObj < tomorrow;
-      default:
-        return true;
-    }
-  });
-
   const getPriorityClass = (priority) => {
     switch (priority) {
       case 'urgent': return 'priority-urgent';
@@ -174,7 +173,7 @@ const CourtDates = ({ currentUser }) => {
       </div>
 
       {/* Court Dates List */}
-      {filteredCourtDates.length === 0 ? (
+      {courtDates.length === 0 ? (
         <div className="card p-12 text-center">
           <svg className="icon-xl mx-auto text-gray-300 mb-4" fill="none" stroke="currentColor" viewBox="0 0 24 24">
             <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M8 7V3m8 4V3m-9 8h10M5 21h14a2 2 0 002-2V7a2 2 0 00-2-2H5a2 2 0 00-2 2v12a2 2 0 002 2z" />
@@ -189,7 +188,7 @@ const CourtDates = ({ currentUser }) => {
         </div>
       ) : (
         <div className="space-y-4">
-          {filteredCourtDates.map((courtDate) => (
+          {courtDates.map((courtDate) => (
             <div key={courtDate.id} className="card p-6">
               <div className="flex items-start justify-between">
                 <div className="flex items-start space-x-4">
@@ -217,7 +216,9 @@ const CourtDates = ({ currentUser }) => {
                       
                       <div>
                         <p className="font-medium text-gray-700 mb-1">Case:</p>
-                        <p>{getCaseInfo(courtDate.case_id)}</p>
+                        <p>{getCaseInfo(courtDate)}</p>
+                        {courtDate.client_name && <p>👤 {courtDate.client_name}</p>}
+                        {courtDate.attorney_name && <p>💼 {courtDate.attorney_name}</p>}
                         {courtDate.notes && (
                           <p className="mt-2 text-gray-600">
                             <span className="font-medium">Notes:</span> {courtDate.notes}